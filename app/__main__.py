@@ -1,33 +1,58 @@
-from . import (
-    images,
-    level_1,
-    level_1a,
-    level_1b,
-    level_2a,
-    level_2b,
-    level_2l,
-    level_3,
-    level_3l,
-    pmtiles,
-    stac,
-)
+from argparse import ArgumentParser
+
+from .config import WORKERS
+from .parallel import get_iso3_list
+from .scheduler import run, select_stages, stages
 
 
 def main() -> None:
-    """Main function, runs all modules in sequence."""
-    if False:
-        level_1.main()
-        level_1a.main()
-        level_1b.main()
-        level_2a.main()
-        level_2b.main()
-        level_2l.main()
-        level_3.main()
-        level_3l.main()
-        images.main()
-        pmtiles.main()
-        stac.main()
-    stac.main()
+    """Main function, runs selected stages for selected countries."""
+    names = [stage for stage in stages if stage != "fused"]
+    parser = ArgumentParser(prog="python -m app")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=names,
+        default=names,
+        help="stages to run, defaults to all",
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        choices=names,
+        default=names[0],
+        help="resume from this stage, assuming earlier stages are complete",
+    )
+    parser.add_argument(
+        "--until",
+        dest="end",
+        choices=names,
+        default=names[-1],
+        help="stop after this stage",
+    )
+    parser.add_argument(
+        "--countries",
+        nargs="+",
+        type=str.upper,
+        default=get_iso3_list(),
+        help="ISO3 codes to run, defaults to the ISO3 environment variable or all",
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="run Level-1a, 1b and 2a in memory as a single stage",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="number of worker processes",
+    )
+    args = parser.parse_args()
+    selected = select_stages(args.stages, args.start, args.end, fused=args.fused)
+    errors = run(selected, args.countries, args.workers)
+    if len(errors):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -1,19 +1,21 @@
 from json import load
-from os import getenv
+from os import getenv, process_cpu_count
 from pathlib import Path
 
 from dotenv import load_dotenv
 from pandas import read_csv
 from pycountry import countries
 
-load_dotenv(override=True)
+load_dotenv()
 
 cwd = Path(__file__).parent
-inputs = cwd / "../inputs"
-outputs = cwd / "../outputs"
+inputs = Path(getenv("INPUTS", cwd / "../inputs"))
+outputs = Path(getenv("OUTPUTS", cwd / "../outputs"))
 gdb = cwd / "../gdb"
-extended = cwd / "../extended"
-stac = cwd / "../stac"
+extended = Path(getenv("EXTENDED", cwd / "../extended"))
+stac = Path(getenv("STAC", cwd / "../stac"))
+cache = Path(getenv("CACHE", cwd / "../cache"))
+global_outputs = outputs / "global"
 
 ADMIN_LEVEL_MAX = 5
 WGS84 = 4326
@@ -73,6 +75,20 @@ iso3_list = [
     x.upper().strip() for x in getenv("ISO3", "").split(",") if x.strip() != ""
 ]
 
+WORKERS = int(getenv("WORKERS", "0")) or process_cpu_count() or 1
+GLOBAL_WORKERS = int(getenv("GLOBAL_WORKERS", "2"))
+force_rebuild = getenv("FORCE", "").lower() in ["1", "true", "yes"]
+intermediate_writes = getenv("INTERMEDIATE_WRITES", "async").lower()
+spatial_sort = getenv("SPATIAL_SORT", "hilbert").lower()
+row_group_size = int(getenv("ROW_GROUP_SIZE", "10000"))
+if intermediate_writes not in ["async", "none"]:
+    msg = f"INTERMEDIATE_WRITES must be async or none, not {intermediate_writes}."
+    raise ValueError(msg)
+if spatial_sort not in ["hilbert", "str", "none"]:
+    msg = f"SPATIAL_SORT must be hilbert, str or none, not {spatial_sort}."
+    raise ValueError(msg)
+memory_budget_mb = int(getenv("MEMORY_BUDGET_MB", "0"))
+
 countries.add_entry(
     alpha_2="XI",
     alpha_3="XIK",
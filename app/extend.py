@@ -0,0 +1,24 @@
+from .config import e1, e2
+from .parallel import get_iso3_list, run_parallel
+from .utils import get_country_files
+
+
+def process_country(iso3: str) -> None:
+    """Checks that extended geometry is up to date for a country.
+
+    Extension from extended/pre to extended/post is done outside of this pipeline,
+    so this only verifies its outputs before Level-2 processing continues.
+
+    Args:
+        iso3: country iso3
+    """
+    for pre in get_country_files(e1, iso3):
+        post = e2 / pre.name
+        if not post.exists() or post.stat().st_mtime < pre.stat().st_mtime:
+            msg = f"{post.name} is missing or older than extended/pre, extend it first."
+            raise FileNotFoundError(msg)
+
+
+def main() -> None:
+    """Checks all countries have been extended."""
+    run_parallel(process_country, get_iso3_list())
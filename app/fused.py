@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import (
+    e1,
+    inputs,
+    intermediate_writes,
+    l1a,
+    l1b,
+    level_1a_fixes,
+    level_2_fixes,
+)
+from .level_1a import dissolve, get_input_files, read_and_fix
+from .level_1b import refactor_columns
+from .level_2a import add_remove_split, get_output_names
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument
+from .parallel import get_iso3_list, run_parallel
+from .utils import get_country_files, to_parquet
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Runs Level-1a, Level-1b and Level-2a for a country in memory.
+
+    Each admin level is passed from dissolve to column refactoring to splitting
+    without reading intermediate files back. Level-1a and Level-1b files are
+    written in a background thread, or skipped if INTERMEDIATE_WRITES is none.
+    Countries split from another one (e.g. HKG from CHN) write no Level-2a files,
+    as those are written by the source country.
+
+    Args:
+        iso3: country iso3
+    """
+    record = get_record(
+        __name__,
+        iso3.lower(),
+        [*get_input_files(iso3), *get_country_files(inputs / "un", iso3)],
+        [level_1a_fixes.get(iso3, {}), level_2_fixes.get(iso3), intermediate_writes],
+    )
+    if is_fresh(record):
+        return
+    gdf, admin_levels = read_and_fix(iso3)
+    if gdf is not None:
+        with ThreadPoolExecutor(1) as writer:
+            writes = []
+            for admin_level, gdf_1a in dissolve(gdf, admin_levels, iso3):
+                gdf_1b = refactor_columns(gdf_1a.copy(deep=False), admin_level)
+                if intermediate_writes != "none":
+                    writes.append(
+                        writer.submit(to_parquet, gdf_1a, iso3, admin_level, "1a"),
+                    )
+                    writes.append(
+                        writer.submit(to_parquet, gdf_1b, iso3, admin_level, "1b"),
+                    )
+                if admin_level == admin_levels and len(get_output_names(iso3)):
+                    add_remove_split(gdf_1b, iso3, admin_level)
+            for write in writes:
+                write.result()
+    save(
+        record,
+        [
+            *get_country_files(l1a, iso3),
+            *get_country_files(l1b, iso3),
+            *[
+                file
+                for name in get_output_names(iso3)
+                for file in get_country_files(e1, name)
+            ],
+        ],
+    )
+
+
+def main() -> None:
+    """Applies all issues in fix.json to files, skipping intermediate reads."""
+    run_parallel(process_country, get_iso3_list())
@@ -0,0 +1,142 @@
+from asyncio import Semaphore, gather, run
+from json import JSONDecodeError, dumps, loads
+from os import getenv
+from time import time
+
+import httpx
+
+from .config import cache
+
+HDX_URL = getenv("HDX_URL", "https://data.humdata.org")
+HDX_CONCURRENCY = int(getenv("HDX_CONCURRENCY", "8"))
+HDX_TIMEOUT = float(getenv("HDX_TIMEOUT", "30"))
+HDX_TTL = int(getenv("HDX_TTL", "86400"))
+HDX_OFFLINE = getenv("HDX_OFFLINE", "").lower() in ["1", "true", "yes"]
+
+hdx_cache = cache / "hdx"
+
+
+def load_cached(iso3: str) -> dict:
+    """Loads the cached HDX response of a country.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        Cached entry with fetch time, validators and result, or an empty dict.
+    """
+    cache_path = hdx_cache / f"{iso3.lower()}.json"
+    if not cache_path.exists():
+        return {}
+    try:
+        return loads(cache_path.read_text())
+    except JSONDecodeError:
+        return {}
+
+
+def save_cached(iso3: str, entry: dict) -> None:
+    """Saves the HDX response of a country to the cache.
+
+    Args:
+        iso3: country iso3
+        entry: entry with fetch time, validators and result.
+    """
+    hdx_cache.mkdir(parents=True, exist_ok=True)
+    cache_path = hdx_cache / f"{iso3.lower()}.json"
+    tmp_path = cache_path.with_suffix(".tmp")
+    tmp_path.write_text(dumps(entry))
+    tmp_path.replace(cache_path)
+
+
+async def fetch(client: httpx.AsyncClient, semaphore: Semaphore, iso3: str) -> dict:
+    """Fetches the COD-AB dataset metadata of a country from HDX.
+
+    Fresh cache entries are used as-is. Stale ones are revalidated with their
+    ETag or Last-Modified header, and kept if the request fails. Only successful
+    responses and 404s, which mean there is no package, are cached.
+
+    Args:
+        client: shared HTTP client.
+        semaphore: limits the number of concurrent requests.
+        iso3: country iso3
+
+    Returns:
+        HDX package metadata, or an empty dict if there is none.
+    """
+    entry = load_cached(iso3)
+    if HDX_OFFLINE or (entry and time() - entry["fetched"] < HDX_TTL):
+        return entry.get("result", {})
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    async with semaphore:
+        try:
+            r = await client.get(
+                "/api/3/action/package_show",
+                params={"id": f"cod-ab-{iso3.lower()}"},
+                headers=headers,
+            )
+        except httpx.HTTPError:
+            return entry.get("result", {})
+    if r.status_code == httpx.codes.NOT_MODIFIED:
+        entry["fetched"] = time()
+        save_cached(iso3, entry)
+        return entry.get("result", {})
+    if r.status_code == httpx.codes.NOT_FOUND:
+        result = {}
+    elif r.is_success:
+        try:
+            result = r.json().get("result") or {}
+        except JSONDecodeError:
+            return entry.get("result", {})
+    else:
+        return entry.get("result", {})
+    save_cached(
+        iso3,
+        {
+            "fetched": time(),
+            "etag": r.headers.get("etag"),
+            "last_modified": r.headers.get("last-modified"),
+            "result": result,
+        },
+    )
+    return result
+
+
+async def fetch_all(iso3s: list[str]) -> dict[str, dict]:
+    """Fetches HDX metadata of many countries over a shared connection pool.
+
+    Args:
+        iso3s: country iso3 codes.
+
+    Returns:
+        Mapping of iso3 to HDX package metadata.
+    """
+    limits = httpx.Limits(
+        max_connections=HDX_CONCURRENCY,
+        max_keepalive_connections=HDX_CONCURRENCY,
+    )
+    async with httpx.AsyncClient(
+        base_url=HDX_URL,
+        limits=limits,
+        timeout=HDX_TIMEOUT,
+    ) as client:
+        semaphore = Semaphore(HDX_CONCURRENCY)
+        results = await gather(*[fetch(client, semaphore, iso3) for iso3 in iso3s])
+    return dict(zip(iso3s, results, strict=True))
+
+
+def get_datasets(iso3s: list[str]) -> dict[str, dict]:
+    """Gets HDX metadata of many countries, using the on-disk cache.
+
+    Set HDX_OFFLINE to only read from the cache.
+
+    Args:
+        iso3s: country iso3 codes.
+
+    Returns:
+        Mapping of iso3 to HDX package metadata.
+    """
+    return run(fetch_all(iso3s))
@@ -1,24 +1,143 @@
+from os import getenv
 from pathlib import Path
 
-from geopandas import read_parquet
+import numpy as np
+import shapely
+from geopandas import GeoSeries, read_parquet
+from PIL import Image, ImageDraw
 from plotly.graph_objects import Choropleth, Figure
-from tqdm import tqdm
+from plotly.io import kaleido
 
-from .config import iso3_list, outputs
+from .config import iso3_list
+from .manifest import get_record, is_fresh, save
+from .parallel import PoolOptions, run_parallel
+from .utils import get_output_files
 
 EPSG_WGS84 = 4326
 PLOTLY_SIMPLIFY = 0.000_1
+IMAGE_SIZE = 600
+IMAGE_SUPERSAMPLE = 2
+FILL_COLOR = (0x1F, 0x77, 0xB4, 0xFF)
+LINE_COLOR = (0xFF, 0xFF, 0xFF, 0xFF)
+
+IMAGE_RENDERER = getenv("IMAGE_RENDERER", "plotly").lower()
+IMAGE_WORKERS = int(getenv("IMAGE_WORKERS", "2"))
+IMAGE_TASKS_PER_CHILD = int(getenv("IMAGE_TASKS_PER_CHILD", "200"))
+if IMAGE_RENDERER not in ["plotly", "pillow"]:
+    msg = f"IMAGE_RENDERER must be plotly or pillow, not {IMAGE_RENDERER}."
+    raise ValueError(msg)
+
+
+def start_renderer() -> None:
+    """Starts the kaleido renderer of a worker before its first image.
+
+    The renderer process is kept alive for every later image rendered by the
+    worker, so only the first one pays its startup cost. MathJax is not used by
+    maps, so it is not loaded.
+    """
+    kaleido.scope.mathjax = None
+    Figure().to_image(format="webp", height=1, width=1)
+
+
+pool: PoolOptions = {
+    "workers": IMAGE_WORKERS,
+    "initializer": start_renderer if IMAGE_RENDERER == "plotly" else None,
+    "max_tasks_per_child": IMAGE_TASKS_PER_CHILD,
+}
+
+
+def get_rings(geometries: GeoSeries, size: int) -> list[list[np.ndarray]]:
+    """Gets polygon rings in pixel coordinates of an equirectangular map.
+
+    Matches the framing of the Plotly renderer: the bounds of all geometries are
+    fitted to the image with equal scale on both axes and centred.
+
+    Args:
+        geometries: polygons in WGS84.
+        size: width and height of the image in pixels.
+
+    Returns:
+        List of polygons, each a list of exterior then interior rings as arrays
+        of pixel coordinates.
+    """
+    min_x, min_y, max_x, max_y = geometries.total_bounds
+    scale = size / max(max_x - min_x, max_y - min_y, 1e-9)
+    offset = np.array(
+        [
+            (size - (max_x - min_x) * scale) / 2,
+            (size - (max_y - min_y) * scale) / 2,
+        ],
+    )
+    origin = np.array([min_x, max_y])
+    flip = np.array([scale, -scale])
+    polygons = shapely.get_parts(
+        geometries[geometries.geom_type.isin(["Polygon", "MultiPolygon"])].array,
+    )
+    result = []
+    for polygon in polygons:
+        rings = [
+            shapely.get_exterior_ring(polygon),
+            *shapely.get_interior_ring(
+                polygon,
+                range(shapely.get_num_interior_rings(polygon)),
+            ),
+        ]
+        coords = [shapely.get_coordinates(ring) for ring in rings]
+        result.append([(ring - origin) * flip + offset for ring in coords])
+    return result
+
+
+def to_webp_pillow(geometries: GeoSeries, file: Path) -> None:
+    """Rasterizes geometries into a WebP image with Pillow.
+
+    Polygons are filled with holes cut out, then all rings are outlined in
+    white. The image is drawn at a higher resolution and downsampled, which
+    antialiases edges like the Plotly renderer.
+
+    Args:
+        geometries: polygons in WGS84.
+        file: output WebP file.
+    """
+    size = IMAGE_SIZE * IMAGE_SUPERSAMPLE
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    fill = Image.new("RGBA", (size, size), FILL_COLOR)
+    polygons = get_rings(geometries, size)
+    for rings in polygons:
+        left, top = np.floor(rings[0].min(axis=0)).astype(int)
+        right, bottom = np.ceil(rings[0].max(axis=0)).astype(int) + 1
+        mask = Image.new("1", (right - left, bottom - top), 0)
+        draw = ImageDraw.Draw(mask)
+        for index, ring in enumerate(rings):
+            points = (ring - [left, top]).ravel().tolist()
+            if len(points) >= 6:  # noqa: PLR2004
+                draw.polygon(points, fill=int(index == 0))
+        image.paste(fill.crop((left, top, right, bottom)), (left, top), mask)
+    draw = ImageDraw.Draw(image)
+    for rings in polygons:
+        for ring in rings:
+            draw.line(ring.ravel().tolist(), fill=LINE_COLOR, width=IMAGE_SUPERSAMPLE)
+    image = image.resize((IMAGE_SIZE, IMAGE_SIZE), Image.Resampling.LANCZOS)
+    image.save(file, "WEBP")
 
 
 def to_webp(file: Path) -> None:
     """Save file as images.
 
+    Uses Plotly and kaleido by default, or Pillow if IMAGE_RENDERER is pillow.
+    Files without geometries have no image.
+
     Args:
         file: file to save.
     """
     gdf = read_parquet(file).to_crs(EPSG_WGS84)
-    gdf = gdf[~gdf.geometry.is_empty]
+    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notna()]
+    if gdf.empty:
+        file.with_suffix(".webp").unlink(missing_ok=True)
+        return
     gdf.geometry = gdf.geometry.simplify(PLOTLY_SIMPLIFY)
+    if IMAGE_RENDERER == "pillow":
+        to_webp_pillow(gdf.geometry, file.with_suffix(".webp"))
+        return
     min_x, min_y, max_x, max_y = gdf.geometry.total_bounds
     fig = Figure(
         Choropleth(
@@ -44,16 +163,42 @@ def to_webp(file: Path) -> None:
     fig.write_image(file.with_suffix(".webp"), height=600, width=600)
 
 
+def process_file(file: Path) -> None:
+    """Save file as images if it changed since the last run.
+
+    Args:
+        file: file to save.
+    """
+    record = get_record(
+        __name__,
+        f"{file.parent.name}/{file.stem}",
+        [file],
+        IMAGE_RENDERER,
+    )
+    if is_fresh(record):
+        return
+    to_webp(file)
+    save(record, [file.with_suffix(".webp")])
+
+
+def process_country(iso3: str) -> None:
+    """Saves all output files of a country as images.
+
+    Args:
+        iso3: country iso3
+    """
+    for file in get_output_files(iso3):
+        process_file(file)
+
+
 def main() -> None:
     """Main function, runs all modules in sequence."""
-    files = sorted(outputs.rglob("*.parquet"))
-    pbar = tqdm(files)
-    for file in pbar:
-        pbar.set_postfix_str(file.stem)
-        iso3 = file.stem.split("_")[0].upper()
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        to_webp(file)
+    files = [
+        file
+        for file in get_output_files()
+        if not len(iso3_list) or file.stem.split("_")[0].upper() in iso3_list
+    ]
+    run_parallel(process_file, files, **pool)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,36 @@
 from pandas import NaT
-from tqdm import tqdm
 
-from .config import ADMIN_LEVEL_MAX, countries, iso3_list
-from .utils import read_parquet, to_parquet
+from .config import ADMIN_LEVEL_MAX, inputs, l1
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument
+from .parallel import get_iso3_list, run_parallel
+from .utils import get_country_files, read_parquet, to_parquet
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Copies source files of a country to Level-1 outputs.
+
+    Args:
+        iso3: country iso3
+    """
+    sources = ["hdx", "itos"]
+    source_files = [
+        file for source in sources for file in get_country_files(inputs / source, iso3)
+    ]
+    record = get_record(__name__, iso3.lower(), source_files)
+    if is_fresh(record):
+        return
+    for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
+        gdf = read_parquet(sources, iso3, admin_level)
+        if gdf is not None:
+            if "validTo" in gdf:
+                gdf["validTo"] = NaT
+                gdf["validTo"] = gdf["validTo"].astype("date32[pyarrow]")
+            to_parquet(gdf, iso3, admin_level, "1")
+    save(record, get_country_files(l1, iso3))
 
 
 def main() -> None:
     """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        sources = ["hdx", "itos"]
-        for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
-            gdf = read_parquet(sources, iso3, admin_level)
-            if gdf is not None:
-                if "validTo" in gdf:
-                    gdf["validTo"] = NaT
-                    gdf["validTo"] = gdf["validTo"].astype("date32[pyarrow]")
-                to_parquet(gdf, iso3, admin_level, "1")
+    run_parallel(process_country, get_iso3_list())
@@ -1,22 +1,63 @@
+from collections.abc import Iterator
+from pathlib import Path
 from re import match
+from tempfile import TemporaryDirectory
 
+import geopandas as gpd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from geopandas import GeoDataFrame
-from pandas import NaT, Timestamp, to_datetime
-from tqdm import tqdm
+from pandas import NaT, Timestamp, concat, to_datetime
 
 from .config import (
     ADMIN_LEVEL_MAX,
     WGS84,
-    apostrophe_chars,
+    cache,
     countries,
-    invisible_chars,
-    iso3_list,
+    inputs,
+    l1a,
     level_1a_fixes,
+    memory_budget_mb,
+)
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument, measure
+from .parallel import get_iso3_list, run_parallel
+from .utils import (
+    dissolve_coverage,
+    from_strings,
+    get_adm0_name,
+    get_country_files,
+    get_epsg_ease,
+    get_source_file,
+    normalize_blanks,
+    normalize_names,
+    read_batches,
+    to_parquet,
+    to_strings,
 )
-from .utils import get_adm0_name, get_epsg_ease, read_parquet, to_parquet
 
+BATCH_MEMORY_FACTOR = 8
 
-def dissolve_and_save(gdf: GeoDataFrame, iso3: str, admin_levels: int):
+
+def dissolve(
+    gdf: GeoDataFrame,
+    admin_levels: int,
+    iso3: str = "",
+    epsg_ease: int | None = None,
+) -> Iterator[tuple[int, GeoDataFrame]]:
+    """Dissolves the finest admin level into each coarser level in turn.
+
+    Args:
+        gdf: GeoDataFrame of the finest admin level.
+        admin_levels: finest admin level.
+        iso3: country iso3, used in metrics.
+        epsg_ease: EASE grid to measure areas in, from the bounds of each level
+            if not set. Set it when dissolving part of a country, so areas use
+            the same grid as the whole country.
+
+    Yields:
+        Tuple of admin level and its GeoDataFrame, from finest to coarsest.
+    """
     for admin_level in range(admin_levels, -1, -1):
         columns = []
         for level in range(admin_level, -1, -1):
@@ -27,13 +68,25 @@ def dissolve_and_save(gdf: GeoDataFrame, iso3: str, admin_levels: int):
             ]
             columns += [f"ADM{level}_PCODE"]
         columns += ["date", "validOn", "validTo", "AREA_SQKM", gdf.active_geometry_name]
-        gdf = gdf.dissolve(f"ADM{admin_level}_PCODE", as_index=False)
-        _, min_y, _, max_y = gdf.geometry.total_bounds
-        epsg_ease = get_epsg_ease(min_y, max_y)
-        gdf["AREA_SQKM"] = gdf.geometry.to_crs(epsg_ease).area / 1e6
+        with measure("level_1a", iso3, "dissolve", gdf, admin_level=admin_level) as m:
+            gdf = dissolve_coverage(gdf, f"ADM{admin_level}_PCODE")
+            m["output"] = gdf
+        with measure("level_1a", iso3, "area", gdf, admin_level=admin_level):
+            if epsg_ease is None:
+                _, min_y, _, max_y = gdf.geometry.total_bounds
+                epsg = get_epsg_ease(min_y, max_y)
+            else:
+                epsg = epsg_ease
+            gdf["AREA_SQKM"] = gdf.geometry.to_crs(epsg).area / 1e6
         gdf = gdf[columns]
         gdf = gdf.sort_values(by=[f"ADM{admin_level}_PCODE"])
-        to_parquet(gdf, iso3, admin_level, "1a")
+        yield admin_level, gdf
+
+
+def dissolve_and_save(gdf: GeoDataFrame, iso3: str, admin_levels: int):
+    for admin_level, gdf_level in dissolve(gdf, admin_levels, iso3):
+        with measure("level_1a", iso3, "write", gdf_level, admin_level=admin_level):
+            to_parquet(gdf_level, iso3, admin_level, "1a")
 
 
 def name_fixes(gdf: GeoDataFrame, iso3: str, iso2: str, admin_level: int):
@@ -54,14 +107,12 @@ def name_fixes(gdf: GeoDataFrame, iso3: str, iso2: str, admin_level: int):
     if "ADM0_PCODE" not in gdf.columns:
         gdf["ADM0_PCODE"] = None
     gdf["ADM0_PCODE"] = gdf["ADM0_PCODE"].fillna(iso2)
-    for column in name_columns:
-        for char in apostrophe_chars:
-            gdf[column] = gdf[column].str.replace(chr(int(char[2:], 16)), "'")
-        for char in invisible_chars:
-            gdf[column] = gdf[column].str.replace(chr(int(char[2:], 16)), "")
-        gdf[column] = gdf[column].replace(r" +", " ", regex=True)
-        gdf[column] = gdf[column].str.strip()
-    return gdf.replace(r"^\s*$", None, regex=True)
+    for column in gdf.columns:
+        if column in name_columns:
+            gdf[column] = normalize_names(gdf[column])
+        elif column != gdf.active_geometry_name:
+            gdf[column] = normalize_blanks(gdf[column])
+    return gdf
 
 
 def automatic_fixes(gdf: GeoDataFrame):
@@ -86,14 +137,25 @@ def config_fixes(gdf: GeoDataFrame, country_config: dict):
         gdf = gdf.rename(columns=country_config["rename"])
     if "title" in country_config:
         for column in country_config["title"]:
-            gdf[column] = gdf[column].str.title()
+            array = to_strings(gdf[column])
+            if array is None:
+                gdf[column] = gdf[column].str.title()
+            else:
+                gdf[column] = from_strings(pc.utf8_title(array), gdf[column])
     if "replace" in country_config:
         for column, replace in country_config["replace"].items():
+            if "" in replace:
+                gdf[column] = gdf[column].fillna(replace[""])
+            array = to_strings(gdf[column])
             for key, value in replace.items():
                 if key == "":
-                    gdf[column] = gdf[column].fillna(value)
-                else:
+                    continue
+                if array is None:
                     gdf[column] = gdf[column].str.replace(key, value)
+                else:
+                    array = pc.replace_substring(array, key, value)
+            if array is not None:
+                gdf[column] = from_strings(array, gdf[column])
     if "date" in country_config:
         gdf["date"] = Timestamp(country_config["date"]).date()
     else:
@@ -105,29 +167,221 @@ def config_fixes(gdf: GeoDataFrame, country_config: dict):
     return gdf
 
 
-def main() -> None:
-    """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and country.alpha_3 not in iso3_list:
-            continue
-        iso2 = country.alpha_2
-        admin_level = ADMIN_LEVEL_MAX
-        country_config = level_1a_fixes.get(iso3, {})
-        sources = ["fix", "hdx", "itos"]
-        if "level" in country_config:
-            admin_level = country_config["level"]
-            gdf = read_parquet(sources, iso3, admin_level)
-        else:
-            for level in range(ADMIN_LEVEL_MAX, -1, -1):
-                admin_level = level
-                gdf = read_parquet(sources, iso3, admin_level)
-                if gdf is not None:
+def get_input_files(iso3: str) -> list[Path]:
+    """Gets all files which may be read when fixing a country.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        List of existing source files.
+    """
+    sources = ["fix", "hdx", "itos"]
+    source_files = [
+        file for source in sources for file in get_country_files(inputs / source, iso3)
+    ]
+    return [inputs / "m49.csv", *source_files]
+
+
+def read_and_fix(iso3: str) -> tuple[GeoDataFrame | None, int]:
+    """Reads the finest admin level of a country and applies all fixes.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        Tuple of fixed GeoDataFrame, or None if there is no source, and its level.
+    """
+    file_path, admin_level = get_source(iso3)
+    with measure("level_1a", iso3, "read") as m:
+        gdf = gpd.read_parquet(file_path) if file_path is not None else None
+        m["output"] = gdf
+    if gdf is not None:
+        with measure("level_1a", iso3, "fixes", gdf, admin_level=admin_level) as m:
+            gdf = apply_fixes(gdf, iso3, admin_level)
+            m["output"] = gdf
+    return gdf, admin_level
+
+
+def apply_fixes(gdf: GeoDataFrame, iso3: str, admin_level: int) -> GeoDataFrame:
+    """Applies config, automatic and name fixes to features of a country.
+
+    Fixes only depend on each row, so they can be applied to a whole layer or
+    to one batch of it at a time.
+
+    Args:
+        gdf: features of the finest admin level.
+        iso3: country iso3
+        admin_level: finest admin level.
+
+    Returns:
+        Fixed GeoDataFrame.
+    """
+    iso2 = countries.get(alpha_3=iso3).alpha_2
+    gdf = config_fixes(gdf, level_1a_fixes.get(iso3, {}))
+    gdf = automatic_fixes(gdf)
+    return name_fixes(gdf, iso3, iso2, admin_level)
+
+
+def get_source(iso3: str) -> tuple[Path | None, int]:
+    """Gets the file of the finest admin level of a country.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        Tuple of source file, or None if there is none, and its admin level.
+    """
+    country_config = level_1a_fixes.get(iso3, {})
+    sources = ["fix", "hdx", "itos"]
+    if "level" in country_config:
+        level = country_config["level"]
+        return get_source_file(sources, iso3, level), level
+    for level in range(ADMIN_LEVEL_MAX, -1, -1):
+        file_path = get_source_file(sources, iso3, level)
+        if file_path is not None:
+            return file_path, level
+    return None, 0
+
+
+def get_batch_size(file: Path) -> int | None:
+    """Gets rows per batch which keep a file within the memory budget.
+
+    Args:
+        file: source file.
+
+    Returns:
+        Rows per batch, or None if the whole file fits the budget.
+    """
+    if not memory_budget_mb:
+        return None
+    with pq.ParquetFile(file) as parquet_file:
+        metadata = parquet_file.metadata
+    size = sum(
+        metadata.row_group(index).total_byte_size
+        for index in range(metadata.num_row_groups)
+    )
+    budget = memory_budget_mb * 2**20
+    if size * BATCH_MEMORY_FACTOR <= budget or metadata.num_rows == 0:
+        return None
+    row_size = size / metadata.num_rows * BATCH_MEMORY_FACTOR
+    return max(int(budget / row_size), 1)
+
+
+def partition(
+    file: Path,
+    iso3: str,
+    admin_level: int,
+    batch_size: int,
+    directory: Path,
+) -> tuple[list[Path], int]:
+    """Fixes a file batch by batch and spills it to disk by ADM1 pcode.
+
+    Args:
+        file: source file.
+        iso3: country iso3
+        admin_level: finest admin level.
+        batch_size: rows per batch.
+        directory: directory for partition files.
+
+    Returns:
+        Tuple of partition directories, one per ADM1 pcode in pcode order, and
+        the EASE grid for the bounds of the whole country.
+    """
+    partitions: dict[str, Path] = {}
+    min_y, max_y = float("inf"), float("-inf")
+    for index, batch in enumerate(read_batches(file, batch_size)):
+        with measure("level_1a", iso3, "fixes", batch, admin_level=admin_level):
+            gdf = apply_fixes(batch, iso3, admin_level)
+        if not gdf.empty:
+            _, batch_min_y, _, batch_max_y = gdf.geometry.total_bounds
+            min_y, max_y = min(min_y, batch_min_y), max(max_y, batch_max_y)
+        for pcode, part in gdf.groupby("ADM1_PCODE", sort=False, dropna=False):
+            key = pcode if isinstance(pcode, str) else ""
+            path = partitions.setdefault(key, directory / str(len(partitions)))
+            path.mkdir(exist_ok=True)
+            part.to_parquet(path / f"{index}.parquet")
+    paths = [partitions[pcode] for pcode in sorted(partitions)]
+    return paths, get_epsg_ease(min_y, max_y)
+
+
+def dissolve_partitioned(
+    file: Path,
+    iso3: str,
+    admin_level: int,
+    batch_size: int,
+) -> None:
+    """Fixes and dissolves a large country one ADM1 partition at a time.
+
+    Features are fixed in batches sized to MEMORY_BUDGET_MB and spilled to disk
+    by ADM1 pcode. Each partition is then dissolved into every level down to
+    ADM1, and each level is spilled again, so only one ADM1 unit's children are
+    dissolved in memory. The spills of each level are finally written like the
+    in-memory path, and ADM1 units are dissolved into ADM0. Areas use the EASE
+    grid of the whole country, so outputs match those of the in-memory path.
+
+    Args:
+        file: source file of the finest admin level.
+        iso3: country iso3
+        admin_level: finest admin level, at least 2.
+        batch_size: rows per batch.
+    """
+    cache.mkdir(parents=True, exist_ok=True)
+    adm1 = []
+    with TemporaryDirectory(dir=cache) as directory:
+        paths, epsg_ease = partition(
+            file,
+            iso3,
+            admin_level,
+            batch_size,
+            Path(directory),
+        )
+        spills: dict[int, list[Path]] = {}
+        for index, path in enumerate(paths):
+            gdf = concat([gpd.read_parquet(part) for part in sorted(path.iterdir())])
+            for level, gdf_level in dissolve(gdf, admin_level, iso3, epsg_ease):
+                if level == 1:
+                    adm1.append(gdf_level)
                     break
+                spill = Path(directory) / f"adm{level}_{index}.parquet"
+                gdf_level.to_parquet(spill)
+                spills.setdefault(level, []).append(spill)
+        for level, files in spills.items():
+            gdf_level = concat(
+                [gpd.read_parquet(spill) for spill in files],
+                ignore_index=True,
+            ).sort_values(by=[f"ADM{level}_PCODE"], ignore_index=True)
+            with measure("level_1a", iso3, "write", gdf_level, admin_level=level):
+                to_parquet(gdf_level, iso3, level, "1a")
+    dissolve_and_save(concat(adm1, ignore_index=True), iso3, 1)
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Applies all fixes to the finest admin level of a country and dissolves it.
+
+    Args:
+        iso3: country iso3
+    """
+    record = get_record(
+        __name__,
+        iso3.lower(),
+        get_input_files(iso3),
+        level_1a_fixes.get(iso3, {}),
+    )
+    if is_fresh(record):
+        return
+    file, admin_level = get_source(iso3)
+    batch_size = get_batch_size(file) if file is not None else None
+    if batch_size is not None and admin_level >= 2:  # noqa: PLR2004
+        dissolve_partitioned(file, iso3, admin_level, batch_size)
+    else:
+        gdf, admin_level = read_and_fix(iso3)
         if gdf is not None:
-            gdf = config_fixes(gdf, country_config)
-            gdf = automatic_fixes(gdf)
-            gdf = name_fixes(gdf, iso3, iso2, admin_level)
             dissolve_and_save(gdf, iso3, admin_level)
+    save(record, get_country_files(l1a, iso3))
+
+
+def main() -> None:
+    """Applies all issues in fix.json to files."""
+    run_parallel(process_country, get_iso3_list())
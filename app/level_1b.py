@@ -1,10 +1,12 @@
 import re
 
 from geopandas import GeoDataFrame, read_parquet
-from tqdm import tqdm
 
-from .config import ADMIN_LEVEL_MAX, countries, iso3_list, l1a
-from .utils import to_parquet
+from .config import ADMIN_LEVEL_MAX, l1a, l1b
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument
+from .parallel import get_iso3_list, run_parallel
+from .utils import get_country_files, to_parquet
 
 
 def get_langs(gdf: GeoDataFrame, admin_level: int) -> list[str]:
@@ -38,18 +40,26 @@ def refactor_columns(gdf: GeoDataFrame, admin_level: int) -> GeoDataFrame:
     return gdf
 
 
+@instrument
+def process_country(iso3: str) -> None:
+    """Refactors columns of all admin levels of a country.
+
+    Args:
+        iso3: country iso3
+    """
+    record = get_record(__name__, iso3.lower(), get_country_files(l1a, iso3))
+    if is_fresh(record):
+        return
+    for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
+        file_path = l1a / f"{iso3.lower()}_adm{admin_level}.parquet"
+        if file_path.exists():
+            gdf = read_parquet(file_path)
+            if gdf is not None:
+                gdf = refactor_columns(gdf, admin_level)
+                to_parquet(gdf, iso3, admin_level, "1b")
+    save(record, get_country_files(l1b, iso3))
+
+
 def main() -> None:
     """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
-            file_path = l1a / f"{iso3.lower()}_adm{admin_level}.parquet"
-            if file_path.exists():
-                gdf = read_parquet(file_path)
-                if gdf is not None:
-                    gdf = refactor_columns(gdf, admin_level)
-                    to_parquet(gdf, iso3, admin_level, "1b")
+    run_parallel(process_country, get_iso3_list())
@@ -1,17 +1,42 @@
 from geopandas import GeoDataFrame, read_parquet
 from pandas import NaT, concat
-from tqdm import tqdm
 
 from .config import (
     ADMIN_LEVEL_MAX,
     WGS84,
-    countries,
     e1,
     inputs,
-    iso3_list,
     l1b,
     level_2_fixes,
 )
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument
+from .parallel import get_iso3_list, run_parallel
+from .utils import get_country_files, write_parquet
+
+split_sources = {
+    name.upper(): iso3
+    for iso3, fixes in level_2_fixes.items()
+    for name in fixes["layers"]
+}
+
+
+def get_output_names(iso3: str) -> list[str]:
+    """Gets names of the layers a country is split into.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        List of lowercase layer names, usually just the country iso3. Empty for
+        countries split from another one (e.g. HKG from CHN), whose layers are
+        written and owned by the source country.
+    """
+    if split_sources.get(iso3, iso3) != iso3:
+        return []
+    if iso3 in level_2_fixes:
+        return list(level_2_fixes[iso3]["layers"])
+    return [iso3.lower()]
 
 
 def add_remove_split(gdf: GeoDataFrame, iso3: str, admin_level: int):
@@ -30,33 +55,45 @@ def add_remove_split(gdf: GeoDataFrame, iso3: str, admin_level: int):
                 gdf_part = gdf[gdf[pcode].isin(args)]
             elif switch == "!=":
                 gdf_part = gdf[~gdf[pcode].isin(args)]
-            gdf_part.to_parquet(
-                e1 / f"{name}_adm{admin_level}.parquet",
-                compression="zstd",
-                geometry_encoding="geoarrow",
-                write_covering_bbox=True,
-            )
+            write_parquet(gdf_part, e1 / f"{name}_adm{admin_level}.parquet")
     else:
-        gdf.to_parquet(
-            e1 / f"{iso3.lower()}_adm{admin_level}.parquet",
-            compression="zstd",
-            geometry_encoding="geoarrow",
-            write_covering_bbox=True,
-        )
+        write_parquet(gdf, e1 / f"{iso3.lower()}_adm{admin_level}.parquet")
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Prepares the finest admin level of a country for extension.
+
+    Args:
+        iso3: country iso3
+    """
+    if not len(get_output_names(iso3)):
+        return
+    record = get_record(
+        __name__,
+        iso3.lower(),
+        [*get_country_files(l1b, iso3), *get_country_files(inputs / "un", iso3)],
+        level_2_fixes.get(iso3),
+    )
+    if is_fresh(record):
+        return
+    for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
+        file_path = l1b / f"{iso3.lower()}_adm{admin_level}.parquet"
+        if file_path.exists():
+            gdf = read_parquet(file_path)
+            if gdf is not None:
+                add_remove_split(gdf, iso3, admin_level)
+                break
+    save(
+        record,
+        [
+            file
+            for name in get_output_names(iso3)
+            for file in get_country_files(e1, name)
+        ],
+    )
 
 
 def main() -> None:
     """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
-            file_path = l1b / f"{iso3.lower()}_adm{admin_level}.parquet"
-            if file_path.exists():
-                gdf = read_parquet(file_path)
-                if gdf is not None:
-                    add_remove_split(gdf, iso3, admin_level)
-                    break
+    run_parallel(process_country, get_iso3_list())
@@ -1,8 +1,10 @@
 from geopandas import GeoDataFrame, read_parquet
-from tqdm import tqdm
 
-from .config import ADMIN_LEVEL_MAX, countries, e2, iso3_list
-from .utils import to_parquet
+from .config import ADMIN_LEVEL_MAX, e2, l2
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument, measure
+from .parallel import get_iso3_list, run_parallel
+from .utils import dissolve_coverage, get_country_files, to_parquet
 
 
 def dissolve_and_save(gdf: GeoDataFrame, iso3: str, admin_levels: int):
@@ -13,24 +15,35 @@ def dissolve_and_save(gdf: GeoDataFrame, iso3: str, admin_levels: int):
             columns += [f"adm{level}_pcode"]
         columns += [x for x in gdf.columns if x.startswith("lang")]
         columns += ["date", "validon", "validto", gdf.active_geometry_name]
-        gdf = gdf.dissolve(f"adm{admin_level}_pcode", as_index=False)
+        with measure("level_2b", iso3, "dissolve", gdf, admin_level=admin_level) as m:
+            gdf = dissolve_coverage(gdf, f"adm{admin_level}_pcode")
+            m["output"] = gdf
         gdf = gdf[columns]
         gdf = gdf.sort_values(by=[f"adm{admin_level}_pcode"])
-        to_parquet(gdf, iso3, admin_level, "2")
+        with measure("level_2b", iso3, "write", gdf, admin_level=admin_level):
+            to_parquet(gdf, iso3, admin_level, "2")
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Dissolves the extended finest admin level of a country into all levels.
+
+    Args:
+        iso3: country iso3
+    """
+    record = get_record(__name__, iso3.lower(), get_country_files(e2, iso3))
+    if is_fresh(record):
+        return
+    for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
+        file_path = e2 / f"{iso3.lower()}_adm{admin_level}.parquet"
+        if file_path.exists():
+            gdf = read_parquet(file_path)
+            if gdf is not None:
+                dissolve_and_save(gdf, iso3, admin_level)
+                break
+    save(record, get_country_files(l2, iso3))
 
 
 def main() -> None:
     """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
-            file_path = e2 / f"{iso3.lower()}_adm{admin_level}.parquet"
-            if file_path.exists():
-                gdf = read_parquet(file_path)
-                if gdf is not None:
-                    dissolve_and_save(gdf, iso3, admin_level)
-                    break
+    run_parallel(process_country, get_iso3_list())
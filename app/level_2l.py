@@ -1,8 +1,15 @@
+import numpy as np
+import shapely
 from geopandas import GeoDataFrame, read_parquet
 from pandas import concat
-from tqdm import tqdm
 
-from .config import ADMIN_LEVEL_MAX, countries, iso3_list, l2, l2l
+from .config import ADMIN_LEVEL_MAX, l2, l2l
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument, measure
+from .parallel import get_iso3_list, run_parallel
+from .utils import get_country_files, write_parquet
+
+LENGTH_TOLERANCE = 1e-6
 
 
 def clip_dissolve_and_save(
@@ -11,8 +18,8 @@ def clip_dissolve_and_save(
     iso3: str,
     admin_level: int,
 ):
-    child.geometry = child.boundary
-    parent.geometry = parent.boundary
+    child = child.set_geometry(child.boundary)
+    parent = parent.set_geometry(parent.boundary)
     lines = child.overlay(parent, how="difference").dissolve()
     lines = lines[[lines.active_geometry_name]]
     lines["bdytyp"] = 10 + admin_level
@@ -20,28 +27,162 @@ def clip_dissolve_and_save(
     return lines
 
 
-def main() -> None:
-    """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and iso3 not in iso3_list:
+def get_segments(gdf: GeoDataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """Splits polygon rings into segments between consecutive vertices.
+
+    Segments are canonicalized so that both directions of a shared edge are equal.
+
+    Args:
+        gdf: polygons.
+
+    Returns:
+        Tuple of segments as rows of x1, y1, x2, y2 and the row of their polygon.
+    """
+    parts, part_rows = shapely.get_parts(gdf.geometry.array, return_index=True)
+    rings, ring_parts = shapely.get_rings(parts, return_index=True)
+    coords, coord_rings = shapely.get_coordinates(rings, return_index=True)
+    same_ring = coord_rings[:-1] == coord_rings[1:]
+    start = coords[:-1][same_ring]
+    end = coords[1:][same_ring]
+    rows = part_rows[ring_parts[coord_rings[:-1][same_ring]]]
+    swap = (start[:, 0] > end[:, 0]) | (
+        (start[:, 0] == end[:, 0]) & (start[:, 1] > end[:, 1])
+    )
+    segments = np.where(
+        swap[:, None],
+        np.hstack([end, start]),
+        np.hstack([start, end]),
+    )
+    not_empty = (start != end).any(axis=1)
+    return segments[not_empty], rows[not_empty]
+
+
+def get_lengths(segments: np.ndarray) -> float:
+    """Gets the total length of segments.
+
+    Args:
+        segments: rows of x1, y1, x2, y2.
+
+    Returns:
+        Sum of segment lengths.
+    """
+    return float(np.hypot(*(segments[:, 2:] - segments[:, :2]).T).sum())
+
+
+def get_topology_lines(
+    gdfs: dict[int, GeoDataFrame],
+    iso3: str,
+) -> GeoDataFrame | None:
+    """Creates boundary lines of all admin levels from shared arcs.
+
+    Edges of the finest level polygons are matched by their vertices. An edge
+    shared by two polygons is a boundary at the coarsest level where their
+    pcodes differ, which is the level at which overlay would have found it.
+    Edges used once make up the country's outer boundary and are left out.
+
+    Args:
+        gdfs: polygons of each admin level of a country, finest level last.
+        iso3: country iso3
+
+    Returns:
+        Boundary lines of all levels, or None if the finest level is not a clean
+        coverage with pcodes for every level.
+    """
+    finest = max(gdfs)
+    gdf = gdfs[finest]
+    columns = [f"adm{level}_pcode" for level in range(finest + 1)]
+    if 0 not in gdfs or any(column not in gdf.columns for column in columns):
+        return None
+    segments, rows = get_segments(gdf)
+    unique, inverse, counts = np.unique(
+        segments,
+        axis=0,
+        return_inverse=True,
+        return_counts=True,
+    )
+    if (counts > 2).any():  # noqa: PLR2004
+        return None
+    outer = get_lengths(unique[counts == 1])
+    expected = float(shapely.length(gdfs[0].boundary.array).sum())
+    if abs(outer - expected) > LENGTH_TOLERANCE * max(expected, 1):
+        return None
+    order = np.argsort(inverse.ravel(), kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    shared = counts == 2  # noqa: PLR2004
+    left = rows[order][offsets[shared]]
+    right = rows[order][offsets[shared] + 1]
+    codes = np.stack([gdf[column].to_numpy(dtype=object) for column in columns])
+    differ = codes[:, left] != codes[:, right]
+    levels = np.where(differ.any(axis=0), differ.argmax(axis=0), 0)
+    arcs = unique[shared]
+    result = []
+    for admin_level in range(finest, 0, -1):
+        level_arcs = arcs[levels == admin_level]
+        if not len(level_arcs):
             continue
-        cty_lines = GeoDataFrame()
-        for admin_level in range(ADMIN_LEVEL_MAX, 0, -1):
-            child_path = l2 / f"{iso3.lower()}_adm{admin_level}.parquet"
-            if child_path.exists():
-                child = read_parquet(child_path)
-                parent = read_parquet(
-                    l2 / f"{iso3.lower()}_adm{admin_level - 1}.parquet",
-                )
-                adm_line = clip_dissolve_and_save(child, parent, iso3, admin_level)
-                cty_lines = concat([cty_lines, adm_line], ignore_index=True)
-        if cty_lines.active_geometry_name and not cty_lines.empty:
-            cty_lines.to_parquet(
-                l2l / f"{iso3.lower()}.parquet",
-                compression="zstd",
-                geometry_encoding="geoarrow",
-                write_covering_bbox=True,
+        lines = shapely.linestrings(level_arcs.reshape(-1, 2, 2))
+        geometry = shapely.line_merge(shapely.multilinestrings(lines))
+        lines = GeoDataFrame(geometry=[geometry], crs=gdf.crs)
+        lines["bdytyp"] = 10 + admin_level
+        lines["iso3cd"] = iso3
+        result.append(lines)
+    return concat(result, ignore_index=True) if len(result) else GeoDataFrame()
+
+
+def get_overlay_lines(gdfs: dict[int, GeoDataFrame], iso3: str) -> GeoDataFrame:
+    """Creates boundary lines of all admin levels with overlay.
+
+    Args:
+        gdfs: polygons of each admin level of a country.
+        iso3: country iso3
+
+    Returns:
+        Boundary lines of all levels.
+    """
+    cty_lines = GeoDataFrame()
+    for admin_level in range(ADMIN_LEVEL_MAX, 0, -1):
+        if admin_level in gdfs:
+            adm_line = clip_dissolve_and_save(
+                gdfs[admin_level],
+                gdfs[admin_level - 1],
+                iso3,
+                admin_level,
             )
+            cty_lines = concat([cty_lines, adm_line], ignore_index=True)
+    return cty_lines
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Creates boundary lines between admin levels of a country.
+
+    Uses shared arcs of the finest level, falling back to overlay of each level
+    with its parent if the finest level is not a clean coverage.
+
+    Args:
+        iso3: country iso3
+    """
+    files = get_country_files(l2, iso3)
+    record = get_record(__name__, iso3.lower(), files)
+    if is_fresh(record):
+        return
+    with measure("level_2l", iso3, "read"):
+        gdfs = {int(file.stem.split("_adm")[1]): read_parquet(file) for file in files}
+    cty_lines = GeoDataFrame()
+    if len(gdfs):
+        with measure("level_2l", iso3, "topology", gdfs[max(gdfs)]) as m:
+            cty_lines = get_topology_lines(gdfs, iso3)
+            m["output"] = cty_lines
+        if cty_lines is None:
+            with measure("level_2l", iso3, "overlay", gdfs[max(gdfs)]) as m:
+                cty_lines = get_overlay_lines(gdfs, iso3)
+                m["output"] = cty_lines
+    if cty_lines.active_geometry_name and not cty_lines.empty:
+        with measure("level_2l", iso3, "write", cty_lines):
+            write_parquet(cty_lines, l2l / f"{iso3.lower()}.parquet")
+    save(record, [l2l / f"{iso3.lower()}.parquet"])
+
+
+def main() -> None:
+    """Applies all issues in fix.json to files."""
+    run_parallel(process_country, get_iso3_list())
@@ -1,33 +1,74 @@
+import numpy as np
 from geopandas import GeoDataFrame, read_parquet
-from tqdm import tqdm
+from pandas import concat
+from shapely import union_all
 
-from .config import ADMIN_LEVEL_MAX, countries, inputs, iso3_list, l2
-from .utils import to_parquet
+from .config import ADMIN_LEVEL_MAX, l2, l3
+from .manifest import get_record, is_fresh, save
+from .metrics import instrument, measure
+from .parallel import get_iso3_list, run_parallel
+from .un import build_caches, get_adm0, get_adm0_path
+from .utils import get_country_files, to_parquet
+
+
+def clip(gdf: GeoDataFrame, cty: GeoDataFrame) -> GeoDataFrame:
+    """Clips features to a country, only intersecting those crossing its border.
+
+    Features properly inside the country are kept as-is and features outside of
+    it are dropped, both found with a spatial index query against the prepared
+    country geometry. Only the band of features touching the border is clipped.
+
+    Args:
+        gdf: admin features.
+        cty: country boundary polygons.
+
+    Returns:
+        Clipped features in their original order.
+    """
+    mask = union_all(cty.geometry.array)
+    inside = gdf.sindex.query(mask, predicate="contains_properly")
+    border = np.setdiff1d(gdf.sindex.query(mask, predicate="intersects"), inside)
+    band = gdf.iloc[border].clip(mask, keep_geom_type=True)
+    return concat([gdf.iloc[inside], band]).sort_index()
 
 
 def clip_and_save(gdf: GeoDataFrame, iso3: str, admin_level: int):
-    if iso3.startswith("X"):
-        adm0 = read_parquet(inputs / "un/bnda_dsp.parquet")
-    else:
-        adm0 = read_parquet(inputs / "un/bnda_cty.parquet")
-    cty = adm0[adm0["iso3cd"] == iso3]
-    gdf = gdf.clip(cty, keep_geom_type=True)
+    with measure("level_3", iso3, "clip", gdf, admin_level=admin_level) as m:
+        cty = get_adm0(iso3)
+        gdf = clip(gdf, cty)
+        m["output"] = gdf
     gdf["validto"] = gdf["validto"].astype("date32[pyarrow]")
     gdf = gdf.reset_index()
-    to_parquet(gdf, iso3, admin_level, "3")
+    with measure("level_3", iso3, "write", gdf, admin_level=admin_level):
+        to_parquet(gdf, iso3, admin_level, "3")
+
+
+@instrument
+def process_country(iso3: str) -> None:
+    """Clips all admin levels of a country to UN international boundaries.
+
+    Args:
+        iso3: country iso3
+    """
+    record = get_record(
+        __name__,
+        iso3.lower(),
+        [get_adm0_path(iso3), *get_country_files(l2, iso3)],
+    )
+    if is_fresh(record):
+        return
+    for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
+        file_path = l2 / f"{iso3.lower()}_adm{admin_level}.parquet"
+        if file_path.exists():
+            with measure("level_3", iso3, "read", admin_level=admin_level) as m:
+                gdf = read_parquet(file_path)
+                m["output"] = gdf
+            if gdf is not None:
+                clip_and_save(gdf, iso3, admin_level)
+    save(record, get_country_files(l3, iso3))
 
 
 def main() -> None:
     """Applies all issues in fix.json to files."""
-    pbar = tqdm(countries)
-    for country in pbar:
-        iso3 = country.alpha_3
-        pbar.set_postfix_str(iso3)
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        for admin_level in range(ADMIN_LEVEL_MAX, -1, -1):
-            file_path = l2 / f"{iso3.lower()}_adm{admin_level}.parquet"
-            if file_path.exists():
-                gdf = read_parquet(file_path)
-                if gdf is not None:
-                    clip_and_save(gdf, iso3, admin_level)
+    build_caches()
+    run_parallel(process_country, get_iso3_list())
@@ -0,0 +1,190 @@
+from functools import lru_cache
+from hashlib import sha256
+from json import dumps, load
+from os.path import relpath
+from pathlib import Path
+
+from .config import cache, cwd, force_rebuild
+
+root = cwd.parent
+manifest = cache / "manifest"
+code_files = sorted(cwd.glob("*.py"))
+
+
+def hash_file(file: Path) -> str:
+    """Gets the SHA-256 hash of a file's content.
+
+    Args:
+        file: file to hash.
+
+    Returns:
+        Hex digest of the file.
+    """
+    digest = sha256()
+    with file.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_object(obj: object) -> str:
+    """Gets the SHA-256 hash of a JSON serializable object.
+
+    Args:
+        obj: object to hash, usually a slice of the fixes config.
+
+    Returns:
+        Hex digest of the object's canonical JSON.
+    """
+    return sha256(dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def get_code_version() -> str:
+    """Gets a hash of the source code of the app.
+
+    Every module is included, so a change to a module a stage imports, such as
+    un.py for Level-3 or level_1a.py for fused, makes its records stale.
+
+    Returns:
+        Hex digest of all app modules in sorted order.
+    """
+    digest = sha256()
+    for file in code_files:
+        digest.update(file.name.encode())
+        digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+def get_files(files: list[Path], previous: dict[str, dict]) -> dict[str, dict]:
+    """Gets size, modification time and hash of files.
+
+    Hashes are reused from the previous record when size and modification time
+    are unchanged, so unchanged inputs are not read again.
+
+    Args:
+        files: files to describe.
+        previous: file descriptions from the previous record.
+
+    Returns:
+        Mapping of path relative to the project root to file description.
+    """
+    result = {}
+    for file in sorted(files):
+        if not file.exists():
+            continue
+        key = relpath(file, root)
+        stat = file.stat()
+        old = previous.get(key, {})
+        if old.get("size") == stat.st_size and old.get("mtime") == stat.st_mtime_ns:
+            file_hash = old["hash"]
+        else:
+            file_hash = hash_file(file)
+        result[key] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": file_hash,
+        }
+    return result
+
+
+def get_record_path(stage: str, key: str) -> Path:
+    """Gets the path of a manifest record.
+
+    Args:
+        stage: stage name.
+        key: task key, usually a lowercase iso3.
+
+    Returns:
+        Path of the JSON record.
+    """
+    return manifest / stage / f"{key}.json"
+
+
+def load_record(stage: str, key: str) -> dict:
+    """Loads a stored manifest record.
+
+    Args:
+        stage: stage name.
+        key: task key.
+
+    Returns:
+        Stored record, or an empty dict if there is none.
+    """
+    record_path = get_record_path(stage, key)
+    if not record_path.exists():
+        return {}
+    with record_path.open() as f:
+        return load(f)
+
+
+def get_record(
+    module: str,
+    key: str,
+    inputs: list[Path],
+    config: object = None,
+) -> dict:
+    """Builds the manifest record describing the current inputs of a task.
+
+    Args:
+        module: name of the stage module, usually __name__.
+        key: task key, usually a lowercase iso3.
+        inputs: input files read by the task.
+        config: slice of config used by the task.
+
+    Returns:
+        Record with input hashes, config hash and code version.
+    """
+    stage = module.split(".")[-1]
+    previous = load_record(stage, key)
+    return {
+        "stage": stage,
+        "key": key,
+        "code": get_code_version(),
+        "config": hash_object(config),
+        "inputs": get_files(inputs, previous.get("inputs", {})),
+    }
+
+
+def is_fresh(record: dict) -> bool:
+    """Checks if the outputs of a task are up to date with its inputs.
+
+    Args:
+        record: record from get_record.
+
+    Returns:
+        True if the stored record matches and all outputs are unchanged.
+    """
+    if force_rebuild:
+        return False
+    stored = load_record(record["stage"], record["key"])
+    if any(stored.get(key) != record[key] for key in ["code", "config", "inputs"]):
+        return False
+    outputs = stored.get("outputs", {})
+    for key, output in outputs.items():
+        output_path = root / key
+        if not output_path.exists():
+            return False
+        stat = output_path.stat()
+        if output["size"] != stat.st_size or output["mtime"] != stat.st_mtime_ns:
+            return False
+    return True
+
+
+def save(record: dict, outputs: list[Path]) -> None:
+    """Stores a manifest record after a task has written its outputs.
+
+    Args:
+        record: record from get_record.
+        outputs: output files written by the task.
+    """
+    stored = load_record(record["stage"], record["key"])
+    record = {
+        **record,
+        "outputs": get_files(outputs, stored.get("outputs", {})),
+    }
+    record_path = get_record_path(record["stage"], record["key"])
+    record_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = record_path.with_suffix(".tmp")
+    tmp_path.write_text(dumps(record, indent=2))
+    tmp_path.replace(record_path)
@@ -0,0 +1,100 @@
+from json import loads
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from geopandas import GeoDataFrame, read_parquet
+from pandas import concat
+
+from .config import GLOBAL_WORKERS, spatial_sort
+from .manifest import get_record, is_fresh, save
+from .parallel import run_parallel
+from .utils import get_global_files, get_global_inputs, write_parquet
+
+EPSG_WGS84 = 4326
+
+
+def get_string_columns(files: list[Path]) -> set[str]:
+    """Gets columns whose types conflict across country files.
+
+    Only file footers are read. Columns with only missing values in a file do
+    not conflict, as they take the type of the other files when merged.
+
+    Args:
+        files: country files.
+
+    Returns:
+        Names of columns to store as strings.
+    """
+    types = {}
+    result = set()
+    for file in files:
+        schema = pq.read_schema(file)
+        geometry_columns = loads(schema.metadata[b"geo"])["columns"]
+        for field in schema:
+            if field.name in geometry_columns or pa.types.is_null(field.type):
+                continue
+            if types.setdefault(field.name, field.type) != field.type:
+                result.add(field.name)
+    return result
+
+
+def read_country(file: Path, string_columns: set[str]) -> GeoDataFrame:
+    """Reads a country file in WGS84 with its iso3 as a column.
+
+    Args:
+        file: country file.
+        string_columns: columns to convert to strings, from get_string_columns.
+
+    Returns:
+        GeoDataFrame with an iso3 column first.
+    """
+    gdf = read_parquet(file).to_crs(EPSG_WGS84)
+    for column in string_columns.intersection(gdf.columns):
+        gdf[column] = gdf[column].astype("string")
+    gdf.insert(0, "iso3", file.stem.split("_")[0].upper())
+    return gdf
+
+
+def process_file(output: Path) -> None:
+    """Merges country files into a global GeoParquet file.
+
+    Rows are sorted spatially with SPATIAL_SORT, so readers filtering by bbox or
+    iso3 skip most of the file. Columns with conflicting types across countries
+    are stored as strings.
+
+    Args:
+        output: global file.
+    """
+    files = get_global_inputs(output)
+    record = get_record(__name__, f"{output.parent.name}/{output.stem}", files)
+    if is_fresh(record) or not len(files):
+        return
+    string_columns = get_string_columns(files)
+    gdf = concat(
+        [read_country(file, string_columns) for file in files],
+        ignore_index=True,
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_suffix(".tmp.parquet")
+    write_parquet(gdf, tmp_path, spatial_sort)
+    tmp_path.replace(output)
+    save(record, [output])
+
+
+def get_outputs() -> list[Path]:
+    """Gets global GeoParquet files, one task each when run by the scheduler.
+
+    Returns:
+        Sorted list of global file paths.
+    """
+    return get_global_files(".parquet")
+
+
+def main() -> None:
+    """Builds global GeoParquet files of all processing levels."""
+    run_parallel(process_file, get_outputs(), GLOBAL_WORKERS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+from argparse import ArgumentParser
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from cProfile import Profile
+from functools import wraps
+from json import dumps
+from os import getenv, getpid
+from resource import RUSAGE_SELF, getrusage
+from signal import SIGINT
+from subprocess import DEVNULL, Popen
+from time import perf_counter
+
+import shapely
+from geopandas import GeoDataFrame
+from pandas import read_json
+
+from .config import cache
+
+METRICS = getenv("METRICS", "").lower() in ["1", "true", "yes"]
+PROFILE = getenv("PROFILE", "").lower()
+PROFILE_COUNTRIES = [x.upper() for x in getenv("PROFILE_COUNTRIES", "").split(",") if x]
+
+metrics_file = cache / "metrics.jsonl"
+profiles = cache / "profiles"
+peaks: list[float] = []
+active: list[str] = []
+
+
+def read_proc(name: str) -> dict[str, int]:
+    """Reads counters of the current process from procfs.
+
+    Args:
+        name: procfs file, e.g. io or status.
+
+    Returns:
+        Mapping of counter name to its first integer value, or an empty dict if
+        procfs is not available.
+    """
+    result = {}
+    try:
+        with open(f"/proc/self/{name}") as f:  # noqa: PTH123
+            for line in f:
+                key, _, value = line.partition(":")
+                parts = value.split()
+                if len(parts) and parts[0].isdigit():
+                    result[key] = int(parts[0])
+    except OSError:
+        return {}
+    return result
+
+
+def reset_peak() -> None:
+    """Resets the peak resident memory of the current process, on Linux only."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:  # noqa: PTH123
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak() -> float:
+    """Gets the peak resident memory since the last reset.
+
+    Returns:
+        Peak memory in MB, since process start where it cannot be reset.
+    """
+    status = read_proc("status")
+    if "VmHWM" in status:
+        return status["VmHWM"] / 1024
+    return getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_counts(gdf: GeoDataFrame | None, prefix: str) -> dict[str, int]:
+    """Gets feature and vertex counts of a GeoDataFrame.
+
+    Args:
+        gdf: GeoDataFrame, or None.
+        prefix: prefix of the keys, input or output.
+
+    Returns:
+        Dict of counts, empty if there is no GeoDataFrame.
+    """
+    if gdf is None:
+        return {}
+    result = {f"{prefix}_features": len(gdf.index)}
+    if gdf.active_geometry_name is not None:
+        vertices = shapely.get_num_coordinates(gdf.geometry.array).sum()
+        result[f"{prefix}_vertices"] = int(vertices)
+    return result
+
+
+@contextmanager
+def measure(
+    stage: str,
+    iso3: str,
+    step: str,
+    gdf: GeoDataFrame | None = None,
+    **fields: object,
+) -> Iterator[dict]:
+    """Records duration, peak memory, I/O and feature counts of a step.
+
+    Does nothing unless METRICS is set. Records are appended as JSON lines to
+    cache/metrics.jsonl. Set the output key of the yielded dict to a
+    GeoDataFrame to record its counts too. Steps can be nested, the peak memory
+    of outer steps includes that of inner ones. Steps are recorded under the
+    stage being run by instrument, e.g. fused for Level-1a steps it runs.
+
+    Args:
+        stage: stage name, used outside of an instrumented stage.
+        iso3: country iso3
+        step: step name, e.g. read, fixes, dissolve, clip or write.
+        gdf: input of the step.
+        **fields: extra fields to record, e.g. admin_level.
+
+    Yields:
+        Dict whose output key may be set to the output of the step.
+    """
+    record = {}
+    if not METRICS:
+        yield record
+        return
+    io = read_proc("io")
+    if len(peaks):
+        peaks[-1] = max(peaks[-1], get_peak())
+    reset_peak()
+    peaks.append(0)
+    start = perf_counter()
+    try:
+        yield record
+    except BaseException:
+        peaks.pop()
+        raise
+    seconds = perf_counter() - start
+    peak = max(get_peak(), peaks.pop())
+    if len(peaks):
+        peaks[-1] = max(peaks[-1], peak)
+    io_end = read_proc("io")
+    result = {
+        "stage": active[0] if len(active) else stage,
+        "iso3": iso3,
+        "step": step,
+        **fields,
+        "pid": getpid(),
+        "seconds": seconds,
+        "peak_mb": peak,
+        "bytes_read": io_end.get("rchar", 0) - io.get("rchar", 0),
+        "bytes_written": io_end.get("wchar", 0) - io.get("wchar", 0),
+        **get_counts(gdf, "input"),
+        **get_counts(record.get("output"), "output"),
+    }
+    cache.mkdir(parents=True, exist_ok=True)
+    with metrics_file.open("a") as f:
+        f.write(dumps(result, default=str) + "\n")
+
+
+@contextmanager
+def profile(stage: str, iso3: str) -> Iterator[None]:
+    """Profiles a country with cProfile or py-spy, if PROFILE is set.
+
+    Profiles are written to cache/profiles, as .prof files for cProfile and as
+    flame graphs for py-spy. PROFILE_COUNTRIES limits profiling to a comma
+    separated list of iso3 codes.
+
+    Args:
+        stage: stage name.
+        iso3: country iso3
+    """
+    if PROFILE not in ["cprofile", "py-spy"] or (
+        len(PROFILE_COUNTRIES) and iso3 not in PROFILE_COUNTRIES
+    ):
+        yield
+        return
+    profiles.mkdir(parents=True, exist_ok=True)
+    path = profiles / f"{stage}_{iso3.lower()}"
+    if PROFILE == "py-spy":
+        process = Popen(
+            ["py-spy", "record", "--pid", str(getpid()), f"--output={path}.svg"],
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+        )
+        try:
+            yield
+        finally:
+            process.send_signal(SIGINT)
+            process.wait()
+    else:
+        profiler = Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+
+
+def instrument(func: Callable[[str], None]) -> Callable[[str], None]:
+    """Measures and optionally profiles a stage's process_country.
+
+    Args:
+        func: process_country function of a stage.
+
+    Returns:
+        Wrapped function, recorded as the total step of the stage.
+    """
+    stage = func.__module__.split(".")[-1]
+
+    @wraps(func)
+    def wrapper(iso3: str) -> None:
+        active.append(stage)
+        try:
+            with profile(stage, iso3), measure(stage, iso3, "total"):
+                func(iso3)
+        finally:
+            active.pop()
+
+    return wrapper
+
+
+def main() -> None:
+    """Prints the slowest steps and total time of each stage."""
+    parser = ArgumentParser(prog="python -m app.metrics")
+    parser.add_argument("--top", type=int, default=20, help="number of steps")
+    args = parser.parse_args()
+    if not metrics_file.exists() or not metrics_file.stat().st_size:
+        print(f"No metrics in {metrics_file}, run stages with METRICS=1 first.")  # noqa: T201
+        raise SystemExit(1)
+    records = read_json(metrics_file, lines=True)
+    steps = records[records["step"] != "total"]
+    columns = ["stage", "iso3", "step", "seconds", "peak_mb"]
+    print(steps.nlargest(args.top, "seconds")[columns].to_string(index=False))  # noqa: T201
+    totals = records[records["step"] == "total"].groupby("stage")
+    print(  # noqa: T201
+        totals.agg(
+            countries=("iso3", "count"),
+            seconds=("seconds", "sum"),
+            peak_mb=("peak_mb", "max"),
+        )
+        .sort_values("seconds", ascending=False)
+        .to_string(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+from collections.abc import Callable, Iterable
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    BrokenExecutor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from contextlib import ExitStack
+from multiprocessing import get_context
+from pathlib import Path
+from traceback import format_exc
+from typing import TypedDict
+
+from tqdm import tqdm
+
+from .config import WORKERS, countries, iso3_list
+
+
+class PoolOptions(TypedDict, total=False):
+    """Worker pool options of a stage, used by run_parallel and the scheduler.
+
+    Stages which need their own pool define these as a module-level pool.
+    """
+
+    workers: int
+    initializer: Callable[[], None] | None
+    max_tasks_per_child: int | None
+
+
+def get_iso3_list() -> list[str]:
+    """Gets ISO3 codes of all countries to process.
+
+    Returns:
+        List of ISO3 codes, filtered by the ISO3 environment variable if set.
+    """
+    return [
+        country.alpha_3
+        for country in countries
+        if not len(iso3_list) or country.alpha_3 in iso3_list
+    ]
+
+
+def get_label(item: object) -> str:
+    """Gets a short label for a task item, used in progress and error reports.
+
+    Args:
+        item: task item, either an ISO3 code or a file path.
+
+    Returns:
+        Label for the item.
+    """
+    if isinstance(item, Path):
+        return item.stem
+    return str(item)
+
+
+def call(func: Callable[[object], None], item: object) -> str | None:
+    """Runs a single task, capturing any error instead of raising it.
+
+    Args:
+        func: function to run.
+        item: argument passed to the function.
+
+    Returns:
+        Formatted traceback if the task failed, otherwise None.
+    """
+    try:
+        func(item)
+    except Exception:  # noqa: BLE001
+        return format_exc()
+    return None
+
+
+def get_executor(
+    workers: int,
+    initializer: Callable[[], None] | None = None,
+    max_tasks_per_child: int | None = None,
+) -> ProcessPoolExecutor:
+    """Creates a process pool for running tasks.
+
+    Uses forkserver so that workers start from a clean interpreter, which is safe
+    with the threads started by tqdm and GDAL in the parent process.
+
+    Args:
+        workers: number of worker processes.
+        initializer: function run once when each worker starts.
+        max_tasks_per_child: tasks run by a worker before it is replaced, which
+            bounds memory held by long-lived workers.
+
+    Returns:
+        Process pool executor.
+    """
+    return ProcessPoolExecutor(
+        workers,
+        mp_context=get_context("forkserver"),
+        initializer=initializer,
+        max_tasks_per_child=max_tasks_per_child,
+    )
+
+
+def submit(  # noqa: PLR0913
+    executors: dict[str | None, ProcessPoolExecutor],
+    pool: str | None,
+    options: PoolOptions,
+    stack: ExitStack,
+    func: Callable[[object], None],
+    item: object,
+) -> Future:
+    """Submits a task to a worker pool, starting the pool if needed.
+
+    A pool whose worker died, e.g. killed for running out of memory, is broken
+    and accepts no more tasks, so it is replaced by a new one.
+
+    Args:
+        executors: running pools by name, updated in place.
+        pool: name of the pool.
+        options: options of the pool.
+        stack: exit stack which shuts pools down.
+        func: function to run.
+        item: argument passed to the function.
+
+    Returns:
+        Future of the task.
+    """
+    executor = executors.get(pool)
+    if executor is not None:
+        try:
+            return executor.submit(call, func, item)
+        except BrokenExecutor:
+            pass
+    executors[pool] = stack.enter_context(
+        get_executor(
+            max(options["workers"], 1),
+            options.get("initializer"),
+            options.get("max_tasks_per_child"),
+        ),
+    )
+    return executors[pool].submit(call, func, item)
+
+
+def get_result(future: Future) -> str | None:
+    """Gets the result of a task, treating a broken pool as a failure of the task.
+
+    Args:
+        future: future returned by submit.
+
+    Returns:
+        Formatted traceback if the task failed, otherwise None.
+    """
+    try:
+        return future.result()
+    except BrokenExecutor:
+        return format_exc()
+
+
+def report_errors(errors: dict[str, str]) -> None:
+    """Prints a summary of failed tasks.
+
+    Args:
+        errors: mapping of task label to formatted traceback.
+    """
+    for label, error in errors.items():
+        tqdm.write(f"ERROR {label}\n{error}")
+    if len(errors):
+        tqdm.write(f"{len(errors)} failed: {', '.join(errors)}")
+
+
+def run_in_process(
+    func: Callable[[object], None],
+    items: list[object],
+    initializer: Callable[[], None] | None,
+    pbar: tqdm,
+) -> dict[str, str]:
+    """Runs a function for each item in the current process.
+
+    Args:
+        func: function taking a single item.
+        items: items to process.
+        initializer: function run once before the first item.
+        pbar: progress bar to update.
+
+    Returns:
+        Mapping of item label to formatted traceback for each failed item.
+    """
+    if initializer is not None:
+        initializer()
+    errors = {}
+    for item in items:
+        pbar.set_postfix_str(get_label(item))
+        error = call(func, item)
+        if error is not None:
+            errors[get_label(item)] = error
+        pbar.update()
+    return errors
+
+
+def run_parallel(
+    func: Callable[[object], None],
+    items: Iterable[object],
+    workers: int = WORKERS,
+    initializer: Callable[[], None] | None = None,
+    max_tasks_per_child: int | None = None,
+) -> dict[str, str]:
+    """Runs a function for each item in a process pool.
+
+    Errors are collected per item so one failing country does not stop the run.
+    Progress of all workers is shown in a single bar.
+
+    Args:
+        func: top-level function taking a single item.
+        items: items to process, usually ISO3 codes or file paths.
+        workers: number of worker processes, runs in-process if 1 or less.
+        initializer: function run once in each worker, or once in-process.
+        max_tasks_per_child: tasks run by a worker before it is replaced.
+
+    Returns:
+        Mapping of item label to formatted traceback for each failed item.
+    """
+    items = list(items)
+    errors = {}
+    pbar = tqdm(total=len(items))
+    if workers <= 1:
+        errors = run_in_process(func, items, initializer, pbar)
+    else:
+        options: PoolOptions = {
+            "workers": workers,
+            "initializer": initializer,
+            "max_tasks_per_child": max_tasks_per_child,
+        }
+        with ExitStack() as stack:
+            executors: dict[str | None, ProcessPoolExecutor] = {}
+            queue = iter(items)
+            pending: dict[Future, object] = {}
+            for item in queue:
+                future = submit(executors, None, options, stack, func, item)
+                pending[future] = item
+                if len(pending) >= workers * 2:
+                    break
+            while len(pending):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    pbar.set_postfix_str(get_label(item))
+                    error = get_result(future)
+                    if error is not None:
+                        errors[get_label(item)] = error
+                    pbar.update()
+                    next_item = next(queue, None)
+                    if next_item is not None:
+                        next_future = submit(
+                            executors,
+                            None,
+                            options,
+                            stack,
+                            func,
+                            next_item,
+                        )
+                        pending[next_future] = next_item
+    pbar.close()
+    report_errors(errors)
+    return errors
@@ -1,49 +1,106 @@
+from os import getenv
 from pathlib import Path
-from subprocess import DEVNULL, run
+from subprocess import DEVNULL, PIPE, CalledProcessError, Popen
+from tempfile import TemporaryFile
 
-from geopandas import read_parquet
-from tqdm import tqdm
+from .config import WORKERS, iso3_list
+from .manifest import get_record, is_fresh, save
+from .parallel import PoolOptions, run_parallel
+from .utils import get_output_files, read_batches
 
-from .config import iso3_list, outputs
+EPSG_WGS84 = 4326
+BATCH_SIZE = 1_000
 
+PMTILES_WORKERS = int(getenv("PMTILES_WORKERS", "0")) or WORKERS
 
-def to_geojsonl(file: Path) -> None:
-    """Save file as GeoJSONSeq."""
-    gdf = read_parquet(file)
-    gdf.to_file(file.with_suffix(".geojsonl"))
+pool: PoolOptions = {"workers": PMTILES_WORKERS}
+
+
+def get_args(file: Path) -> list[str]:
+    """Gets the tippecanoe command for a file read from stdin.
+
+    Args:
+        file: source file, its stem is used as the layer name.
+
+    Returns:
+        Command line arguments.
+    """
+    return [
+        "tippecanoe",
+        "--drop-densest-as-needed",
+        "--extend-zooms-if-still-dropping",
+        "--force",
+        "--maximum-zoom=g",
+        "--quiet",
+        "--simplify-only-low-zooms",
+        f"--layer={file.stem}",
+        f"--output={file.with_suffix('.pmtiles')}",
+    ]
 
 
 def to_pmtiles(file: Path) -> None:
-    """Save file as PMTiles."""
-    run(
-        [
-            "tippecanoe",
-            "--drop-densest-as-needed",
-            "--extend-zooms-if-still-dropping",
-            "--force",
-            "--maximum-zoom=g",
-            "--read-parallel",
-            "--simplify-only-low-zooms",
-            f"--output={file.with_suffix('.pmtiles')}",
-            file.with_suffix(".geojsonl"),
-        ],
-        check=False,
-        stderr=DEVNULL,
-    )
+    """Save file as PMTiles.
+
+    Features are read and streamed to tippecanoe as GeoJSON one batch at a time,
+    so no temporary copy of the file is written to disk and memory stays bounded
+    for large global files.
+
+    Args:
+        file: file to convert.
+
+    Raises:
+        CalledProcessError: tippecanoe failed, with its stderr attached.
+    """
+    args = get_args(file)
+    with TemporaryFile() as stderr:
+        with Popen(
+            args,
+            bufsize=0,
+            stdin=PIPE,
+            stdout=DEVNULL,
+            stderr=stderr,
+        ) as process:
+            try:
+                for batch in read_batches(file, BATCH_SIZE):
+                    gdf = batch.to_crs(EPSG_WGS84)
+                    text = gdf.to_json(drop_id=True, default=str)
+                    process.stdin.write(f"{text}\n".encode())
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        if process.returncode != 0:
+            stderr.seek(0)
+            file.with_suffix(".pmtiles").unlink(missing_ok=True)
+            raise CalledProcessError(process.returncode, args, stderr=stderr.read())
+
+
+def convert(file: Path) -> None:
+    """Converts a file to PMTiles if it changed since the last run."""
+    record = get_record(__name__, f"{file.parent.name}/{file.stem}", [file])
+    if is_fresh(record):
+        return
+    to_pmtiles(file)
+    save(record, [file.with_suffix(".pmtiles")])
+
+
+def process_country(iso3: str) -> None:
+    """Converts all output files of a country to PMTiles.
+
+    Args:
+        iso3: country iso3
+    """
+    for file in get_output_files(iso3):
+        convert(file)
 
 
 def main() -> None:
     """Main function, runs all modules in sequence."""
-    files = sorted(outputs.rglob("*.parquet"))
-    pbar = tqdm(files)
-    for file in pbar:
-        pbar.set_postfix_str(file.stem)
-        iso3 = file.stem.split("_")[0].upper()
-        if len(iso3_list) and iso3 not in iso3_list:
-            continue
-        to_geojsonl(file)
-        to_pmtiles(file)
-        file.with_suffix(".geojsonl").unlink()
+    files = [
+        file
+        for file in get_output_files()
+        if not len(iso3_list) or file.stem.split("_")[0].upper() in iso3_list
+    ]
+    run_parallel(convert, files, **pool)
 
 
 if __name__ == "__main__":
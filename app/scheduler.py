@@ -0,0 +1,384 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+from heapq import heapify, heappop, heappush
+from itertools import count
+from pathlib import Path
+from types import ModuleType
+
+from tqdm import tqdm
+
+from . import (
+    extend,
+    fused,
+    images,
+    level_1,
+    level_1a,
+    level_1b,
+    level_2a,
+    level_2b,
+    level_2l,
+    level_3,
+    level_3l,
+    merge,
+    pmtiles,
+    stac,
+    tile_join,
+)
+from .config import GLOBAL_WORKERS, WORKERS
+from .level_2a import split_sources
+from .parallel import PoolOptions, get_result, report_errors, submit
+from .un import build_caches
+
+type Task = tuple[str, str | Path | None]
+
+stages: dict[str, ModuleType] = {
+    "1": level_1,
+    "1a": level_1a,
+    "1b": level_1b,
+    "2a": level_2a,
+    "fused": fused,
+    "extend": extend,
+    "2b": level_2b,
+    "2l": level_2l,
+    "3": level_3,
+    "3l": level_3l,
+    "merge": merge,
+    "images": images,
+    "pmtiles": pmtiles,
+    "tile_join": tile_join,
+    "stac": stac,
+}
+upstream = {
+    "1a": ["1"],
+    "1b": ["1a"],
+    "2a": ["1b"],
+    "fused": ["1"],
+    "extend": ["2a", "fused"],
+    "2b": ["extend"],
+    "2l": ["2b"],
+    "3": ["2b"],
+    "3l": ["2l"],
+    "merge": ["1", "1a", "1b", "fused", "2b", "2l", "3", "3l"],
+    "images": ["1", "1a", "1b", "fused", "3", "3l"],
+    "pmtiles": ["1", "1a", "1b", "fused", "3", "3l"],
+    "tile_join": ["pmtiles"],
+    "stac": ["images", "pmtiles"],
+}
+global_stages = ["merge", "tile_join", "stac"]
+cache_stages = ["3", "3l"]
+fused_stages = ["1a", "1b", "2a"]
+
+
+def select_stages(
+    names: list[str],
+    start: str,
+    end: str,
+    *,
+    fused: bool = False,
+) -> list[str]:
+    """Selects stages to run from the command line options.
+
+    Args:
+        names: stages to run.
+        start: first stage, earlier stages are assumed complete.
+        end: last stage.
+        fused: run Level-1a, 1b and 2a in memory as the fused stage.
+
+    Returns:
+        Selected stage names.
+    """
+    order = [stage for stage in stages if stage != "fused"]
+    selected = [
+        stage
+        for stage in order[order.index(start) : order.index(end) + 1]
+        if stage in names
+    ]
+    if fused and any(stage in selected for stage in fused_stages):
+        selected = [stage for stage in selected if stage not in fused_stages]
+        selected.append("fused")
+    return selected
+
+
+def run_task(task: Task) -> None:
+    """Runs a single stage for a single country or global file.
+
+    Args:
+        task: tuple of stage name and country iso3, global file, or None for a
+            global stage with a single output.
+    """
+    stage, key = task
+    if key is None:
+        stages[stage].main()
+    elif isinstance(key, Path):
+        stages[stage].process_file(key)
+    else:
+        stages[stage].process_country(key)
+
+
+def get_stage_tasks(stage: str, iso3s: list[str]) -> list[Task]:
+    """Gets all tasks of a stage.
+
+    Global stages with many outputs, such as merge, have one task per global
+    file, so they share the global pool instead of starting a pool of their own.
+
+    Args:
+        stage: stage name.
+        iso3s: countries to run.
+
+    Returns:
+        List of tasks.
+    """
+    if stage not in global_stages:
+        return [(stage, iso3) for iso3 in iso3s]
+    if hasattr(stages[stage], "get_outputs"):
+        return [(stage, output) for output in stages[stage].get_outputs()]
+    return [(stage, None)]
+
+
+def get_upstream_tasks(task: Task, iso3s: list[str]) -> list[Task]:
+    """Gets tasks which must finish before a task can start.
+
+    Countries split at Level-2a (e.g. HKG from CHN) depend on the country they
+    were split from, whose Level-2a task writes their files.
+
+    Args:
+        task: tuple of stage name and country iso3.
+        iso3s: all countries being processed.
+
+    Returns:
+        List of upstream tasks, including ones which are not selected to run.
+    """
+    stage, iso3 = task
+    result = []
+    for parent in upstream.get(stage, []):
+        if parent in global_stages or stage in global_stages:
+            result.extend(get_stage_tasks(parent, iso3s))
+        else:
+            result.append((parent, iso3))
+            if parent in ["2a", "fused"] and split_sources.get(iso3, iso3) != iso3:
+                result.append((parent, split_sources[iso3]))
+    return result
+
+
+def get_graph(selected: list[str], iso3s: list[str]) -> dict[Task, set[Task]]:
+    """Builds the dependency graph of stage and country tasks.
+
+    Upstream stages which are not selected are assumed to be complete, so a run
+    can resume from any stage.
+
+    Args:
+        selected: stages to run.
+        iso3s: countries to run.
+
+    Returns:
+        Mapping of each task to the selected tasks it depends on.
+    """
+    tasks = [
+        task
+        for stage in stages
+        if stage in selected
+        for task in get_stage_tasks(stage, iso3s)
+    ]
+    graph = {task: set() for task in tasks}
+    for task in tasks:
+        stack = get_upstream_tasks(task, iso3s)
+        seen = set()
+        while len(stack):
+            parent = stack.pop()
+            if parent in seen:
+                continue
+            seen.add(parent)
+            if parent in graph:
+                graph[task].add(parent)
+            else:
+                stack.extend(get_upstream_tasks(parent, iso3s))
+    return graph
+
+
+def get_label(task: Task) -> str:
+    """Gets a short label for a task.
+
+    Args:
+        task: tuple of stage name and country iso3.
+
+    Returns:
+        Label for the task.
+    """
+    stage, key = task
+    if isinstance(key, Path):
+        return f"{stage}:{key.parent.name}/{key.stem}"
+    return stage if key is None else f"{stage}:{key}"
+
+
+def get_pool(task: Task) -> str | None:
+    """Gets the name of the worker pool a task runs in.
+
+    Args:
+        task: tuple of stage name and country iso3.
+
+    Returns:
+        Global for global stages, stage name if the stage defines its own pool,
+        or None for the shared one.
+    """
+    stage, _ = task
+    if stage in global_stages:
+        return "global"
+    return stage if hasattr(stages[stage], "pool") else None
+
+
+def get_pools(
+    graph: dict[Task, set[Task]],
+    workers: int,
+) -> dict[str | None, PoolOptions]:
+    """Gets the options of every worker pool used by a graph.
+
+    Args:
+        graph: dependency graph from get_graph.
+        workers: number of worker processes of the shared pool.
+
+    Returns:
+        Mapping of pool name to its options.
+    """
+    pools: dict[str | None, PoolOptions] = {None: {"workers": workers}}
+    for task in graph:
+        pool = get_pool(task)
+        if pool == "global":
+            pools[pool] = {"workers": GLOBAL_WORKERS}
+        elif pool is not None:
+            pools[pool] = stages[pool].pool
+    return pools
+
+
+def pop_ready(
+    ready: list[tuple[int, int, Task]],
+    running: dict[str | None, int],
+    pools: dict[str | None, PoolOptions],
+) -> list[Task]:
+    """Pops ready tasks in priority order while their pools have free workers.
+
+    Args:
+        ready: heap of ready tasks, tasks which cannot start are pushed back.
+        running: number of running tasks in each pool, updated in place.
+        pools: options of each pool from get_pools.
+
+    Returns:
+        Tasks to submit.
+    """
+    result = []
+    held = []
+    while len(ready):
+        entry = heappop(ready)
+        pool = get_pool(entry[-1])
+        if running[pool] >= max(pools[pool]["workers"], 1):
+            held.append(entry)
+            continue
+        running[pool] += 1
+        result.append(entry[-1])
+    for entry in held:
+        heappush(ready, entry)
+    return result
+
+
+def get_dependents(graph: dict[Task, set[Task]]) -> dict[Task, list[Task]]:
+    """Gets the tasks which depend on each task.
+
+    Args:
+        graph: dependency graph from get_graph.
+
+    Returns:
+        Mapping of each task to the tasks which depend on it.
+    """
+    dependents: dict[Task, list[Task]] = {task: [] for task in graph}
+    for task, parents in graph.items():
+        for parent in parents:
+            dependents[parent].append(task)
+    return dependents
+
+
+def get_downstream(task: Task, dependents: dict[Task, list[Task]]) -> set[Task]:
+    """Gets all tasks downstream of a task.
+
+    Args:
+        task: tuple of stage name and country iso3.
+        dependents: mapping of each task to the tasks which depend on it.
+
+    Returns:
+        Set of downstream tasks.
+    """
+    result = set()
+    stack = list(dependents[task])
+    while len(stack):
+        child = stack.pop()
+        if child not in result:
+            result.add(child)
+            stack.extend(dependents[child])
+    return result
+
+
+def run(selected: list[str], iso3s: list[str], workers: int = WORKERS) -> dict:
+    """Runs selected stages for selected countries as a dependency graph.
+
+    A country moves on to its next stage as soon as its upstream tasks finish,
+    instead of waiting for every country to finish the current stage. Tasks
+    downstream of a failure are skipped. Stages with a module-level pool, such
+    as images and pmtiles, run in their own worker pool with those options, and
+    global stages run one task per global file in a small pool of their own. A
+    worker which dies fails its task, and its pool is replaced. UN boundary
+    caches are built once before any task starts, so country tasks of Level-3
+    only read them.
+
+    Args:
+        selected: stages to run.
+        iso3s: countries to run.
+        workers: number of worker processes of the shared pool.
+
+    Returns:
+        Mapping of task label to formatted traceback for each failed task.
+    """
+    graph = get_graph(selected, iso3s)
+    order = list(stages)
+    dependents = get_dependents(graph)
+    remaining = {task: len(parents) for task, parents in graph.items()}
+    counter = count()
+    ready = [
+        (-order.index(task[0]), next(counter), task)
+        for task in graph
+        if remaining[task] == 0
+    ]
+    heapify(ready)
+    if any(task[0] in cache_stages for task in graph):
+        build_caches()
+    pools = get_pools(graph, workers)
+    running = dict.fromkeys(pools, 0)
+    errors = {}
+    skipped = set()
+    pbar = tqdm(total=len(graph))
+    with ExitStack() as stack:
+        executors: dict[str | None, ProcessPoolExecutor] = {}
+        pending: dict[Future, Task] = {}
+        while len(ready) or len(pending):
+            for task in pop_ready(ready, running, pools):
+                pool = get_pool(task)
+                future = submit(executors, pool, pools[pool], stack, run_task, task)
+                pending[future] = task
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                running[get_pool(task)] -= 1
+                pbar.set_postfix_str(get_label(task))
+                pbar.update()
+                error = get_result(future)
+                if error is not None:
+                    errors[get_label(task)] = error
+                    skipped |= get_downstream(task, dependents)
+                    continue
+                for child in dependents[task]:
+                    remaining[child] -= 1
+                    if remaining[child] == 0 and child not in skipped:
+                        heappush(ready, (-order.index(child[0]), next(counter), child))
+    pbar.update(len(skipped))
+    pbar.close()
+    report_errors(errors)
+    if len(skipped):
+        tqdm.write(f"{len(skipped)} skipped after upstream failures.")
+    return errors
@@ -1,17 +1,23 @@
 import re
 from datetime import UTC, datetime, time
+from json import loads
 from os import getenv
-from shutil import rmtree
+from pathlib import Path
 
-import httpx
+import pyarrow.parquet as pq
 import pystac
-from geopandas import GeoDataFrame, GeoSeries, read_parquet
-from pandas import Timestamp
+from geopandas import GeoDataFrame, read_parquet
+from pandas import Timestamp, to_datetime
 from pycountry import languages
-from shapely.geometry import box
+from pyproj import CRS, Transformer
+from pystac.stac_io import DefaultStacIO
+from shapely.geometry import box, shape
 from tqdm import tqdm
 
-from .config import countries, processing_levels, stac
+from .config import countries, outputs, processing_levels, spatial_sort, stac
+from .hdx import get_datasets
+from .manifest import get_record, is_fresh, save
+from .utils import get_output_files, write_parquet
 
 EPSG_WGS84 = 4326
 
@@ -19,6 +25,9 @@ API_URL = getenv("API_URL", "")
 S3_ASSETS_URL = getenv("S3_ASSETS_URL", "")
 TILES_URL = getenv("TILES_URL", "")
 
+stac_parquet = outputs / "stac"
+hierarchy_rels = ["self", "root", "parent", "collection"]
+
 formats = [
     ("geojson", pystac.MediaType.GEOJSON),
     ("gpkg", pystac.MediaType.GEOPACKAGE),
@@ -29,25 +38,222 @@ formats = [
 ]
 
 
-def get_date(gdf: GeoDataFrame, key: str):
-    return (
-        datetime.combine(Timestamp(gdf[key].iloc[0]), time(0, 0, 0)).replace(tzinfo=UTC)
-        if key in gdf and gdf[key].iloc[0] is not None
-        else datetime.now(tz=UTC)
+class ChangedStacIO(DefaultStacIO):
+    """Writes STAC JSON files only when their content changed."""
+
+    def __init__(self) -> None:
+        """Initializes the set of all files which belong to the catalog."""
+        super().__init__()
+        self.hrefs = set()
+
+    def write_text_to_href(self, href: str, txt: str) -> None:
+        """Writes text to a file, skipping files which are unchanged.
+
+        Args:
+            href: path of the file.
+            txt: text to write.
+        """
+        path = Path(href)
+        self.hrefs.add(path.resolve())
+        if path.exists() and path.read_text() == txt:
+            return
+        super().write_text_to_href(href, txt)
+
+
+def remove_stale(stac_io: ChangedStacIO) -> None:
+    """Removes JSON files and folders which are no longer part of the catalog.
+
+    Args:
+        stac_io: STAC IO used to save the catalog.
+    """
+    for path in stac.rglob("*.json"):
+        if path.resolve() not in stac_io.hrefs:
+            path.unlink()
+    for path in sorted(stac.rglob("*"), reverse=True):
+        if path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+
+
+def get_parquet_asset(name: str) -> pystac.Asset:
+    """Gets the asset linking to the stac-geoparquet mirror of a collection.
+
+    Args:
+        name: name of the stac-geoparquet file.
+
+    Returns:
+        Asset with the collection-mirror role.
+    """
+    return pystac.Asset(
+        href=f"{S3_ASSETS_URL}/stac/{name}.parquet",
+        media_type="application/vnd.apache.parquet",
+        title="STAC GeoParquet",
+        roles=["collection-mirror"],
     )
 
 
-def get_langs(gdf: GeoDataFrame, admin_level: int | None = None) -> list[dict]:
+def to_stac_geoparquet(items: list[pystac.Item], file: Path) -> None:
+    """Writes items as a single stac-geoparquet file.
+
+    Properties are flattened into columns. Rows are sorted spatially with
+    SPATIAL_SORT and have a bbox covering column, so bbox queries only read
+    overlapping row groups.
+
+    Args:
+        items: STAC items.
+        file: output file.
+    """
+    records = []
+    geometries = []
+    for item in items:
+        record = item.to_dict(include_self_link=False, transform_hrefs=False)
+        geometries.append(shape(record.pop("geometry")))
+        record.pop("bbox", None)
+        record["links"] = [
+            link for link in record["links"] if link["rel"] not in hierarchy_rels
+        ]
+        records.append({**record, **record.pop("properties")})
+    gdf = GeoDataFrame(records, geometry=geometries, crs=EPSG_WGS84)
+    for column in ["datetime", "start_datetime", "end_datetime"]:
+        if column in gdf.columns:
+            gdf[column] = to_datetime(gdf[column], utc=True)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    write_parquet(gdf, file, spatial_sort, geometry_encoding="WKB")
+
+
+def get_bbox_stats(file: pq.ParquetFile, covering: dict) -> list[float] | None:
+    """Gets the bounding box of a file from statistics of its bbox covering column.
+
+    Args:
+        file: GeoParquet file.
+        covering: bbox covering from GeoParquet metadata.
+
+    Returns:
+        Bounding box as minx, miny, maxx, maxy, or None if any row group has no
+        statistics for the covering column.
+    """
+    paths = {".".join(path): key for key, path in covering.items()}
+    bounds = {}
+    for index in range(file.metadata.num_row_groups):
+        row_group = file.metadata.row_group(index)
+        for column in range(row_group.num_columns):
+            chunk = row_group.column(column)
+            key = paths.get(chunk.path_in_schema)
+            if key is None or chunk.statistics is None:
+                continue
+            stats = chunk.statistics
+            bounds.setdefault(key, []).append(
+                stats.min if key.endswith("min") else stats.max,
+            )
+    keys = ["xmin", "ymin", "xmax", "ymax"]
+    num_row_groups = file.metadata.num_row_groups
+    if not num_row_groups or any(
+        len(bounds.get(key, [])) < num_row_groups for key in keys
+    ):
+        return None
+    return [
+        min(bounds["xmin"]),
+        min(bounds["ymin"]),
+        max(bounds["xmax"]),
+        max(bounds["ymax"]),
+    ]
+
+
+def read_metadata(file: Path) -> dict:
+    """Reads what an item needs from a GeoParquet file without decoding geometry.
+
+    Uses the GeoParquet metadata and row group statistics from the footer, plus a
+    projected read of the first row of date and language columns. Files without
+    a bbox in either are measured from their geometry instead.
+
+    Args:
+        file: GeoParquet file.
+
+    Returns:
+        Dict with column names, first row values, row count, WGS84 bbox, EPSG and
+        modification date.
+    """
+    with pq.ParquetFile(file) as parquet_file:
+        schema = parquet_file.schema_arrow
+        count = parquet_file.metadata.num_rows
+        geo = loads(schema.metadata[b"geo"])
+        geometry_name = geo["primary_column"]
+        geometry = geo["columns"][geometry_name]
+        covering = geometry.get("covering", {}).get("bbox", {})
+        hidden = [geometry_name, *{path[0] for path in covering.values()}]
+        columns = [name for name in schema.names if name not in hidden]
+        keys = ["date", "validOn", "validon", "lang", "lang1", "lang2"]
+        row = {}
+        if count > 0:
+            table = parquet_file.read_row_group(
+                0,
+                columns=[key for key in keys if key in columns],
+            )
+            row = table.slice(0, 1).to_pylist()[0] if table.num_rows else {}
+        bbox = geometry.get("bbox") or get_bbox_stats(parquet_file, covering)
+    crs = CRS.from_user_input(geometry.get("crs", "OGC:CRS84") or "OGC:CRS84")
+    if bbox is None:
+        gdf = read_parquet(file, columns=[geometry_name])
+        bbox = gdf.geometry.to_crs(EPSG_WGS84).total_bounds.tolist()
+    elif not crs.equals("OGC:CRS84", ignore_axis_order=True):
+        transformer = Transformer.from_crs(crs, EPSG_WGS84, always_xy=True)
+        bbox = list(transformer.transform_bounds(*bbox))
+    return {
+        "columns": columns,
+        "row": row,
+        "count": count,
+        "bbox": bbox,
+        "epsg": crs.to_epsg() or EPSG_WGS84,
+        "modified": datetime.fromtimestamp(file.stat().st_mtime, tz=UTC).date(),
+    }
+
+
+def get_bounds(bboxes: list[list[float]]) -> list[float]:
+    """Gets the bounding box of many bounding boxes.
+
+    Args:
+        bboxes: bounding boxes as minx, miny, maxx, maxy.
+
+    Returns:
+        Bounding box covering all inputs.
+    """
+    return [
+        min(bbox[0] for bbox in bboxes),
+        min(bbox[1] for bbox in bboxes),
+        max(bbox[2] for bbox in bboxes),
+        max(bbox[3] for bbox in bboxes),
+    ]
+
+
+def get_date(metadata: dict, *keys: str) -> datetime:
+    """Gets a date of a layer, stable between runs so unchanged items are kept.
+
+    Args:
+        metadata: Current layer's metadata from read_metadata.
+        *keys: date columns in order of preference.
+
+    Returns:
+        First date found, or the day the file was last modified if it has none.
+    """
+    for key in keys:
+        if metadata["row"].get(key) is not None:
+            return datetime.combine(
+                Timestamp(metadata["row"][key]),
+                time(0, 0, 0),
+            ).replace(tzinfo=UTC)
+    return datetime.combine(metadata["modified"], time(0, 0, 0)).replace(tzinfo=UTC)
+
+
+def get_langs(metadata: dict, admin_level: int | None = None) -> list[dict]:
     """Gets a list of language codes.
 
     Args:
-        gdf: Current layer's GeoDataFrame.
+        metadata: Current layer's metadata from read_metadata.
         admin_level: Current layer's admin level.
 
     Returns:
         _description_
     """
-    columns = list(gdf.columns)
+    columns = metadata["columns"]
     if admin_level is None:
         p = re.compile(r"^ADM\d_\w{2}$")
     else:
@@ -55,9 +261,9 @@ def get_langs(gdf: GeoDataFrame, admin_level: int | None = None) -> list[dict]:
     langs1 = [x.split("_")[1].lower() for x in columns if p.search(x)]
     langs1 = list(dict.fromkeys(langs1))
     langs2 = [
-        gdf[key].iloc[0]
+        metadata["row"][key]
         for key in ["lang", "lang1", "lang2"]
-        if key in gdf and gdf[key].iloc[0] is not None
+        if metadata["row"].get(key) is not None
     ]
     result = []
     for lang in [*langs1, *langs2]:
@@ -142,111 +348,163 @@ def add_assets_lines(
     return item
 
 
-def get_collection(processing_level: str, description: str) -> pystac.Collection:
-    """Main function, runs all modules in sequence."""
+def get_item(
+    file: Path,
+    metadata: dict,
+    iso3: str,
+    processing_level: str,
+) -> pystac.Item:
+    """Gets the item of an admin level file.
+
+    The item spans from the date of the layer to its validOn date.
+
+    Args:
+        file: GeoParquet file of an admin level.
+        metadata: metadata of the file from read_metadata.
+        iso3: country iso3.
+        processing_level: processing level.
+
+    Returns:
+        Item with assets.
+    """
+    adm_level = int(file.stem.split("_adm")[1])
+    valid_on = "validOn" if processing_level < "1b" else "validon"
+    date_end = get_date(metadata, valid_on, "date")
+    item = pystac.Item(
+        id=file.stem,
+        geometry=box(*metadata["bbox"]).__geo_interface__,
+        bbox=metadata["bbox"],
+        start_datetime=get_date(metadata, "date", valid_on),
+        end_datetime=date_end,
+        datetime=date_end,
+        properties={
+            "admin:level": adm_level,
+            "admin:count": metadata["count"],
+            "languages": get_langs(metadata, adm_level),
+            "proj:code": f"EPSG:{metadata['epsg']}",
+        },
+    )
+    return add_assets(item, iso3.lower(), adm_level, processing_level)
+
+
+def get_lines_item(
+    iso3: str,
+    processing_level: str,
+    last_item: pystac.Item,
+) -> pystac.Item | None:
+    """Gets the item of the lines file of a country, if it has one.
+
+    Args:
+        iso3: country iso3.
+        processing_level: processing level.
+        last_item: item of the finest admin level, whose dates the lines share.
+
+    Returns:
+        Item with assets, or None if the processing level has no lines file.
+    """
+    if processing_level < "2":
+        return None
+    file = processing_levels[f"{processing_level}l"] / f"{iso3.lower()}.parquet"
+    if not file.exists():
+        return None
+    metadata = read_metadata(file)
+    item = pystac.Item(
+        id=f"{file.stem}_lines",
+        geometry=box(*metadata["bbox"]).__geo_interface__,
+        bbox=metadata["bbox"],
+        start_datetime=last_item.common_metadata.start_datetime,
+        end_datetime=last_item.common_metadata.end_datetime,
+        datetime=last_item.datetime,
+        properties={
+            "proj:code": f"EPSG:{metadata['epsg']}",
+        },
+    )
+    return add_assets_lines(item, iso3.lower(), processing_level)
+
+
+def get_collection(
+    processing_level: str,
+    description: str,
+    datasets: dict[str, dict],
+) -> tuple[pystac.Collection, list[tuple[dict, Path]]]:
+    """Main function, runs all modules in sequence.
+
+    Country collections whose files, HDX metadata and code are unchanged since
+    the last run are loaded from the existing catalog instead of being rebuilt.
+
+    Returns:
+        Tuple of processing level collection and manifest records of rebuilt
+        country collections with their folders, to be saved once the catalog is
+        written.
+    """
     collections = []
-    geometries_all = []
+    records = []
+    bboxes_all = []
     intervals_all = []
     pbar = tqdm(countries)
     for country in pbar:
         iso3 = country.alpha_3
         pbar.set_postfix_str(iso3)
-        r = httpx.get(
-            f"https://data.humdata.org/api/3/action/package_show?id=cod-ab-{iso3.lower()}",
-        )
-        hdx = r.json().get("result", {})
+        hdx = datasets.get(iso3, {})
         files = sorted(
             processing_levels[processing_level].glob(f"{iso3.lower()}_adm*.parquet"),
         )
         if len(files) == 0:
             continue
+        collection_id = f"cod-ab-l{processing_level}-{iso3.lower()}"
+        collection_dir = stac / f"cod-ab-l{processing_level}" / collection_id
+        lines = processing_levels.get(f"{processing_level}l")
+        record = get_record(
+            __name__,
+            collection_id,
+            [*files, *([lines / f"{iso3.lower()}.parquet"] if lines else [])],
+            [hdx, API_URL, S3_ASSETS_URL, TILES_URL],
+        )
+        if is_fresh(record) and (collection_dir / "collection.json").exists():
+            collection = pystac.Collection.from_file(
+                str(collection_dir / "collection.json"),
+            )
+            bboxes_all.append(collection.extent.spatial.bboxes[0])
+            intervals_all.extend(item.datetime for item in collection.get_items())
+            collections.append(collection)
+            continue
         items = []
-        geometries = []
+        bboxes = []
         intervals = []
         proj_codes = set()
-        date_start = None
-        date_end = None
         for file in files:
-            adm_level = int(file.stem.split("_adm")[1])
-            gdf = read_parquet(file)
-            # dissolve = gdf.dissolve()
-            item = pystac.Item(
-                id=file.stem,
-                # geometry=dissolve.convex_hull.iloc[0].__geo_interface__,
-                # bbox=dissolve.total_bounds.tolist(),
-                geometry=box(
-                    *gdf.geometry.to_crs(EPSG_WGS84).total_bounds,
-                ).__geo_interface__,
-                bbox=gdf.geometry.to_crs(EPSG_WGS84).total_bounds.tolist(),
-                start_datetime=get_date(gdf, "date"),
-                end_datetime=get_date(
-                    gdf,
-                    "validOn" if processing_level < "1b" else "validon",
-                ),
-                datetime=get_date(
-                    gdf,
-                    "validOn" if processing_level < "1b" else "validon",
-                ),
-                properties={
-                    "admin:level": adm_level,
-                    "admin:count": len(gdf.index),
-                    "languages": get_langs(gdf, adm_level),
-                    "proj:code": f"EPSG:{gdf.geometry.crs.to_epsg() or EPSG_WGS84}",
-                },
-            )
-            item = add_assets(item, iso3.lower(), adm_level, processing_level)
+            metadata = read_metadata(file)
+            item = get_item(file, metadata, iso3, processing_level)
             items.append(item)
-            # geometries.append(dissolve.geometry.envelope.iloc[0])
-            # geometries_all.append(dissolve.geometry.envelope.iloc[0])
-            proj_codes.add(f"EPSG:{gdf.geometry.crs.to_epsg() or EPSG_WGS84}")
-            geometries.append(gdf.geometry.envelope.iloc[0])
-            geometries_all.append(gdf.geometry.envelope.iloc[0])
-            intervals.append(get_date(gdf, "date"))
-            intervals.append(
-                get_date(
-                    gdf,
-                    "validOn" if processing_level < "1b" else "validon",
-                ),
-            )
-            intervals_all.append(item.datetime)
-            date_start = get_date(gdf, "date")
-            date_end = get_date(
-                gdf,
-                "validOn" if processing_level < "1b" else "validon",
+            proj_codes.add(f"EPSG:{metadata['epsg']}")
+            bboxes.append(metadata["bbox"])
+            bboxes_all.append(metadata["bbox"])
+            intervals.extend(
+                [
+                    item.common_metadata.start_datetime,
+                    item.common_metadata.end_datetime,
+                ],
             )
-        if processing_level >= "2":
-            file = processing_levels[f"{processing_level}l"] / f"{iso3.lower()}.parquet"
-            if file.exists():
-                gdf = read_parquet(file)
-                item = pystac.Item(
-                    id=f"{file.stem}_lines",
-                    geometry=box(
-                        *gdf.geometry.to_crs(EPSG_WGS84).total_bounds,
-                    ).__geo_interface__,
-                    bbox=gdf.geometry.to_crs(EPSG_WGS84).total_bounds.tolist(),
-                    start_datetime=date_start,
-                    end_datetime=date_end,
-                    datetime=date_end,
-                    properties={
-                        "proj:code": f"EPSG:{gdf.geometry.crs.to_epsg() or EPSG_WGS84}",
-                    },
-                )
-                item = add_assets_lines(item, iso3.lower(), processing_level)
-                items.append(item)
+        lines_item = get_lines_item(iso3, processing_level, items[-1])
+        if lines_item is not None:
+            items.append(lines_item)
+        intervals_all.extend(item.datetime for item in items)
         collection = pystac.Collection(
-            id=f"cod-ab-l{processing_level}-{iso3.lower()}",
+            id=collection_id,
             title=country.name,
             description=(
                 f"COD-AB at Level-{processing_level} processing for {country.name}."
             ),
             extent=pystac.Extent(
-                pystac.SpatialExtent(GeoSeries(geometries).total_bounds.tolist()),
+                pystac.SpatialExtent(get_bounds(bboxes)),
                 pystac.TemporalExtent([sorted(intervals)[i] for i in (0, -1)]),
             ),
             license="CC-BY-3.0-IGO",
             summaries=pystac.Summaries(
                 {
-                    "languages": get_langs(gdf),
+                    # Lines files have no name columns, so languages are read
+                    # from the finest admin level.
+                    "languages": get_langs(metadata),
                     "country:alpha_3": iso3,
                     "country:alpha_2": country.alpha_2,
                     "country:numeric": country.numeric,
@@ -264,7 +522,7 @@ def get_collection(processing_level: str, description: str) -> pystac.Collection
         collection.add_link(
             pystac.Link(
                 rel=pystac.RelType.PREVIEW,
-                target=f"{S3_ASSETS_URL}/level-{processing_level}/{iso3.lower()}_adm{adm_level}.webp",
+                target=f"{S3_ASSETS_URL}/level-{processing_level}/{files[-1].stem}.webp",
                 media_type="image/webp",
             ),
         )
@@ -278,18 +536,20 @@ def get_collection(processing_level: str, description: str) -> pystac.Collection
             )
         collection.add_items(items)
         collections.append(collection)
+        records.append((record, collection_dir))
     collection_all = pystac.Collection(
         id=f"cod-ab-l{processing_level}",
         title=f"Level-{processing_level} Processing",
         description=description,
         extent=pystac.Extent(
-            pystac.SpatialExtent(GeoSeries(geometries_all).total_bounds.tolist()),
+            pystac.SpatialExtent(get_bounds(bboxes_all)),
             pystac.TemporalExtent([sorted(intervals_all)[i] for i in (0, -1)]),
         ),
         license="CC-BY-3.0-IGO",
     )
+    collection_all.add_asset("parquet", get_parquet_asset(collection_all.id))
     collection_all.add_children(collections)
-    return collection_all
+    return collection_all, records
 
 
 def main():
@@ -298,6 +558,18 @@ def main():
         title="COD-AB",
         description="Common Operational Datasets - Administrative Boundaries.",
     )
+    datasets = get_datasets(
+        [country.alpha_3 for country in countries if get_output_files(country.alpha_3)],
+    )
+    catalog.add_link(
+        pystac.Link(
+            rel=pystac.RelType.ALTERNATE,
+            target=get_parquet_asset(catalog.id).href,
+            media_type="application/vnd.apache.parquet",
+            title="STAC GeoParquet",
+        ),
+    )
+    records = []
     for processing_level, description in [
         (
             "1",
@@ -309,10 +581,28 @@ def main():
         ("2", "Geometry extended outward for pre-edge-matching."),
         ("3", "Geometry edge-matched to UN Geo Hub International Boundaries."),
     ]:
-        collection = get_collection(processing_level, description)
+        collection, level_records = get_collection(
+            processing_level,
+            description,
+            datasets,
+        )
         catalog.add_child(collection)
-    rmtree(stac, ignore_errors=True)
-    catalog.normalize_and_save(str(stac), pystac.CatalogType.SELF_CONTAINED)
+        records.extend(level_records)
+    stac_io = ChangedStacIO()
+    catalog.normalize_and_save(
+        str(stac),
+        pystac.CatalogType.SELF_CONTAINED,
+        stac_io=stac_io,
+    )
+    remove_stale(stac_io)
+    items_all = []
+    for collection in catalog.get_children():
+        items = list(collection.get_items(recursive=True))
+        to_stac_geoparquet(items, stac_parquet / f"{collection.id}.parquet")
+        items_all.extend(items)
+    to_stac_geoparquet(items_all, stac_parquet / f"{catalog.id}.parquet")
+    for record, collection_dir in records:
+        save(record, sorted(collection_dir.rglob("*.json")))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+from pathlib import Path
+from subprocess import DEVNULL, PIPE, run
+
+from .config import GLOBAL_WORKERS
+from .manifest import get_record, is_fresh, save
+from .parallel import run_parallel
+from .utils import get_global_files, get_global_inputs
+
+
+def process_file(output: Path) -> None:
+    """Merges country PMTiles into a global archive with tile-join.
+
+    Countries are tiled separately by the pmtiles stage, which skips unchanged
+    files, so a refresh only re-tiles changed countries before joining. Layers
+    are renamed after the admin level so all countries share one layer.
+
+    Args:
+        output: global archive.
+    """
+    files = get_global_inputs(output)
+    record = get_record(__name__, f"{output.parent.name}/{output.stem}", files)
+    if is_fresh(record) or not len(files):
+        return
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_suffix(".tmp.pmtiles")
+    run(
+        [
+            "tile-join",
+            "--force",
+            "--no-tile-size-limit",
+            "--quiet",
+            *[f"--rename-layer={file.stem}:{output.stem}" for file in files],
+            f"--output={tmp_path}",
+            *files,
+        ],
+        check=True,
+        stdout=DEVNULL,
+        stderr=PIPE,
+    )
+    tmp_path.replace(output)
+    save(record, [output])
+
+
+def get_outputs() -> list[Path]:
+    """Gets global PMTiles archives, one task each when run by the scheduler.
+
+    Returns:
+        Sorted list of global file paths.
+    """
+    return get_global_files(".pmtiles")
+
+
+def main() -> None:
+    """Builds global PMTiles archives of all processing levels."""
+    run_parallel(process_file, get_outputs(), GLOBAL_WORKERS)
+
+
+if __name__ == "__main__":
+    main()
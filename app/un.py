@@ -0,0 +1,203 @@
+from functools import cache, lru_cache
+from os import getpid
+from pathlib import Path
+
+import pyarrow as pa
+from geopandas import GeoDataFrame, read_parquet
+from pyarrow import ipc
+
+from .config import cache as cache_dir
+from .config import inputs
+
+un = inputs / "un"
+un_cache = cache_dir / "un"
+bndl = un / "bndl.parquet"
+
+
+def get_adm0_path(iso3: str) -> Path:
+    """Gets the UN boundary file used to clip a country.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        Path of disputed areas for X-prefixed codes, otherwise of countries.
+    """
+    if iso3.startswith("X"):
+        return un / "bnda_dsp.parquet"
+    return un / "bnda_cty.parquet"
+
+
+def get_version(file: Path) -> bytes:
+    """Gets a cheap version identifier of a source file.
+
+    Args:
+        file: source file.
+
+    Returns:
+        Size and modification time of the file.
+    """
+    stat = file.stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}".encode()
+
+
+def is_current(target: Path, version: bytes) -> bool:
+    """Checks if a cached Arrow file was built from the current source.
+
+    Args:
+        target: cached Arrow file.
+        version: version of the source file.
+
+    Returns:
+        True if the cache exists and matches the source version.
+    """
+    if not target.exists():
+        return False
+    with pa.memory_map(str(target)) as source:
+        metadata = ipc.open_file(source).schema.metadata or {}
+    return metadata.get(b"source") == version
+
+
+def write_cache(gdf: GeoDataFrame, target: Path, version: bytes) -> None:
+    """Writes a GeoDataFrame as an uncompressed Arrow file for memory mapping.
+
+    Args:
+        gdf: GeoDataFrame sorted by its partition column.
+        target: cached Arrow file.
+        version: version of the source file.
+    """
+    table = pa.table(gdf.to_arrow(index=False, geometry_encoding="WKB"))
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), b"source": version},
+    )
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_suffix(f".{getpid()}.tmp")
+    with ipc.new_file(tmp_path, table.schema) as writer:
+        writer.write_table(table)
+    tmp_path.replace(target)
+
+
+def build_adm0(name: str) -> Path:
+    """Builds the cache of a UN boundary file, sorted by iso3cd.
+
+    Args:
+        name: name of the boundary file, bnda_cty or bnda_dsp.
+
+    Returns:
+        Path of the cached Arrow file.
+    """
+    source = un / f"{name}.parquet"
+    target = un_cache / f"{name}.arrow"
+    version = get_version(source)
+    if not is_current(target, version):
+        gdf = read_parquet(source)
+        gdf["iso3cd"] = gdf["iso3cd"].fillna("")
+        gdf = gdf.sort_values("iso3cd", kind="stable")
+        write_cache(gdf, target, version)
+    return target
+
+
+def read_cache(target: Path, key: str) -> tuple[pa.Table, dict[str, tuple[int, int]]]:
+    """Memory maps a cached Arrow file and indexes its partitions.
+
+    Pages of the file are shared through the OS page cache by all workers.
+
+    Args:
+        target: cached Arrow file.
+        key: column the file is sorted by.
+
+    Returns:
+        Tuple of table and mapping of partition value to row offset and length.
+    """
+    table = ipc.open_file(pa.memory_map(str(target))).read_all()
+    index = {}
+    for offset, value in enumerate(table[key].to_pylist()):
+        start, length = index.get(value, (offset, 0))
+        index[value] = (start, length + 1)
+    return table, index
+
+
+@cache
+def load_adm0(name: str) -> tuple[pa.Table, dict[str, tuple[int, int]]]:
+    """Loads a UN boundary file once per process.
+
+    Args:
+        name: name of the boundary file, bnda_cty or bnda_dsp.
+
+    Returns:
+        Tuple of table and iso3cd index.
+    """
+    return read_cache(build_adm0(name), "iso3cd")
+
+
+@lru_cache(maxsize=16)
+def get_adm0(iso3: str) -> GeoDataFrame:
+    """Gets the UN boundary polygons of a country.
+
+    Only the rows of the country are decoded, the rest of the file is untouched.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        GeoDataFrame of the country's boundary polygons.
+    """
+    table, index = load_adm0(get_adm0_path(iso3).stem)
+    start, length = index.get(iso3, (0, 0))
+    return GeoDataFrame.from_arrow(table.slice(start, length))
+
+
+def build_bndl() -> Path:
+    """Builds the cache of UN boundary lines, partitioned by iso3.
+
+    Lines are dissolved by type and iso3cd once per release of the source file.
+    Lines shared by many countries have an iso3cd listing each of them, so they
+    are repeated under every iso3 they list.
+
+    Returns:
+        Path of the cached Arrow file.
+    """
+    target = un_cache / "bndl.arrow"
+    version = get_version(bndl)
+    if not is_current(target, version):
+        gdf = read_parquet(bndl)
+        gdf["iso3cd"] = gdf["iso3cd"].fillna("")
+        gdf = gdf[~gdf["bdytyp"].isin([6, 7])]
+        gdf = gdf[["bdytyp", "iso3cd", gdf.active_geometry_name]]
+        gdf = gdf.dissolve(by=["bdytyp", "iso3cd"], as_index=False)
+        gdf["iso3"] = gdf["iso3cd"].str.findall(r"[A-Z]{3}")
+        gdf = gdf.explode("iso3", ignore_index=True).dropna(subset=["iso3"])
+        gdf = gdf.sort_values(["iso3", "bdytyp"], kind="stable")
+        write_cache(gdf, target, version)
+    return target
+
+
+@cache
+def load_bndl() -> tuple[pa.Table, dict[str, tuple[int, int]]]:
+    """Loads UN boundary lines once per process.
+
+    Returns:
+        Tuple of table and iso3 index.
+    """
+    return read_cache(build_bndl(), "iso3")
+
+
+def get_bndl(iso3: str) -> GeoDataFrame:
+    """Gets the UN boundary lines of a country.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        GeoDataFrame of boundary lines dissolved by type and iso3cd.
+    """
+    table, index = load_bndl()
+    start, length = index.get(iso3, (0, 0))
+    return GeoDataFrame.from_arrow(table.slice(start, length)).drop(columns="iso3")
+
+
+def build_caches() -> None:
+    """Builds caches of all UN boundary files before workers start."""
+    for name in ["bnda_cty", "bnda_dsp"]:
+        build_adm0(name)
+    build_bndl()
@@ -1,9 +1,234 @@
+from collections.abc import Iterator
+from json import loads
+from pathlib import Path
 from typing import Literal
 
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
 from geopandas import GeoDataFrame
+from numpy import arange, argsort, ceil, concatenate, isin, lexsort, ndarray, sqrt
+from pandas import RangeIndex, Series
+from pandas.api.types import infer_dtype
+from shapely import Geometry
+from shapely.errors import GEOSException
 
-from .config import inputs, m49, processing_levels
+from .config import (
+    ADMIN_LEVEL_MAX,
+    apostrophe_chars,
+    global_outputs,
+    inputs,
+    invisible_chars,
+    m49,
+    outputs,
+    processing_levels,
+    row_group_size,
+)
+
+
+def get_text_replacements() -> list[tuple[str, str]]:
+    """Compiles character fixes into one regex character class per replacement.
+
+    Returns:
+        List of RE2 patterns and their replacement.
+    """
+    translations = {
+        **{char: "'" for char in apostrophe_chars},
+        **{char: "" for char in invisible_chars},
+    }
+    result = []
+    for replacement in dict.fromkeys(translations.values()):
+        chars = [char for char, value in translations.items() if value == replacement]
+        pattern = "".join(f"\\x{{{char[2:]}}}" for char in chars)
+        result.append((f"[{pattern}]", replacement))
+    return result
+
+
+text_replacements = get_text_replacements()
+
+
+def to_strings(series: Series) -> pa.Array | None:
+    """Converts a column to an Arrow string array.
+
+    Args:
+        series: column to convert.
+
+    Returns:
+        Arrow string array, or None if the column holds anything but strings.
+    """
+    if infer_dtype(series, skipna=True) != "string":
+        return None
+    return pa.array(series, type=pa.string(), from_pandas=True)
+
+
+def from_strings(array: pa.Array, series: Series) -> Series:
+    """Converts an Arrow string array back to a column.
+
+    Args:
+        array: Arrow string array.
+        series: original column, used for its index and name.
+
+    Returns:
+        Column of Python strings and None.
+    """
+    return Series(
+        array.to_numpy(zero_copy_only=False),
+        index=series.index,
+        name=series.name,
+    )
+
+
+def blank_to_null(array: pa.Array) -> pa.Array:
+    """Replaces strings which are empty or only whitespace with null.
+
+    Args:
+        array: Arrow string array.
+
+    Returns:
+        Arrow string array.
+    """
+    is_blank = pc.equal(pc.utf8_trim_whitespace(array), "")
+    return pc.if_else(is_blank, pa.scalar(None, pa.string()), array)
+
+
+def normalize_names(series: Series) -> Series:
+    """Normalizes a name column in a single vectorized pass per operation.
+
+    Replaces apostrophe variants, removes invisible characters, collapses repeated
+    spaces, trims whitespace and sets blank names to null.
+
+    Args:
+        series: name column.
+
+    Returns:
+        Normalized column, or the column from normalize_blanks if it does not
+        only hold strings.
+    """
+    array = to_strings(series)
+    if array is None:
+        return normalize_blanks(series)
+    for pattern, replacement in text_replacements:
+        array = pc.replace_substring_regex(array, pattern, replacement)
+    array = pc.replace_substring_regex(array, " +", " ")
+    array = pc.utf8_trim_whitespace(array)
+    return from_strings(blank_to_null(array), series)
+
+
+def normalize_blanks(series: Series) -> Series:
+    """Sets blank values of a string column to null.
+
+    Object columns which mix strings with other values are replaced with a regex,
+    so their blank strings are set to null as well.
+
+    Args:
+        series: column to normalize.
+
+    Returns:
+        Normalized column, or the original column if it holds no strings.
+    """
+    array = to_strings(series)
+    if array is None:
+        if series.dtype == object:
+            return series.replace(r"^\s*$", None, regex=True)
+        return series
+    return from_strings(blank_to_null(array), series)
+
+
+def get_country_files(directory: Path, iso3: str) -> list[Path]:
+    """Gets all admin level files of a country in a directory.
+
+    Args:
+        directory: directory to search.
+        iso3: country iso3
+
+    Returns:
+        Sorted list of existing files.
+    """
+    return [
+        file
+        for admin_level in range(ADMIN_LEVEL_MAX + 1)
+        if (file := directory / f"{iso3.lower()}_adm{admin_level}.parquet").exists()
+    ]
+
+
+def get_output_files(iso3: str | None = None) -> list[Path]:
+    """Gets output files of all processing levels, including boundary lines.
+
+    Args:
+        iso3: country iso3, gets files of all countries if None.
+
+    Returns:
+        Sorted list of existing files.
+    """
+    if iso3 is None:
+        patterns = ["*.parquet"]
+    else:
+        patterns = [f"{iso3.lower()}_adm*.parquet", f"{iso3.lower()}.parquet"]
+    return sorted(
+        file
+        for directory in processing_levels.values()
+        for pattern in patterns
+        for file in directory.glob(pattern)
+    )
+
+
+def get_global_files(suffix: str) -> list[Path]:
+    """Gets global files to build, one per processing level and admin level.
+
+    Files are listed whether or not country files exist yet, so the scheduler
+    can plan them before upstream stages run. Files without country files are
+    skipped when built.
+
+    Args:
+        suffix: suffix of the country files to merge, e.g. .parquet or .pmtiles.
+
+    Returns:
+        Sorted list of global file paths, named after the admin level or lines.
+    """
+    result = []
+    for name, directory in processing_levels.items():
+        if name.endswith("l"):
+            names = ["lines"]
+        else:
+            names = [f"adm{level}" for level in range(ADMIN_LEVEL_MAX + 1)]
+        result.extend(global_outputs / directory.name / f"{x}{suffix}" for x in names)
+    return sorted(result)
+
+
+def get_global_inputs(file: Path) -> list[Path]:
+    """Gets the country files merged into a global file.
+
+    Args:
+        file: global file from get_global_files.
+
+    Returns:
+        Sorted list of country files.
+    """
+    source = outputs / file.parent.name
+    if file.stem == "lines":
+        return sorted(source.glob(f"???{file.suffix}"))
+    return sorted(source.glob(f"???_{file.stem}{file.suffix}"))
+
+
+def get_source_file(sources: list[str], iso3: str, admin_level: int) -> Path | None:
+    """Gets the preferred file path for a particular iso3 and admin level combination.
+
+    Args:
+        sources: list of sources
+        iso3: country iso3
+        admin_level: admin level
+
+    Returns:
+        Path of the first source which has the file, if any.
+    """
+    file_name = f"{iso3.lower()}_adm{admin_level}.parquet"
+    for source in sources:
+        file_path = inputs / source / file_name
+        if file_path.exists():
+            return file_path
+    return None
 
 
 def read_parquet(
@@ -21,14 +246,55 @@ def read_parquet(
     Returns:
         GeoDataFrame of admin boundaries if they exist.
     """
-    file_name = f"{iso3.lower()}_adm{admin_level}.parquet"
-    for source in sources:
-        file_path = inputs / source / file_name
-        if file_path.exists():
-            return gpd.read_parquet(file_path)
+    file_path = get_source_file(sources, iso3, admin_level)
+    if file_path is not None:
+        return gpd.read_parquet(file_path)
     return None
 
 
+def get_bbox_columns(schema: pa.Schema) -> list[str]:
+    """Gets bbox covering columns of a GeoParquet schema.
+
+    Args:
+        schema: Arrow schema with GeoParquet metadata.
+
+    Returns:
+        Names of covering columns, which are not read as data.
+    """
+    geo = loads(schema.metadata[b"geo"])
+    return [
+        column["covering"]["bbox"]["xmin"][0]
+        for column in geo["columns"].values()
+        if "bbox" in column.get("covering", {})
+    ]
+
+
+def read_batches(file: Path, batch_size: int) -> Iterator[GeoDataFrame]:
+    """Reads a GeoParquet file as a stream of GeoDataFrames.
+
+    Batches are decoded like geopandas.read_parquet, so they match the
+    GeoDataFrame read by the in-memory path, while only one batch is held in
+    memory at a time.
+
+    Args:
+        file: source file.
+        batch_size: rows per batch.
+
+    Yields:
+        GeoDataFrame of each batch.
+    """
+    with pq.ParquetFile(file) as parquet_file:
+        schema = parquet_file.schema_arrow
+        bbox_columns = get_bbox_columns(schema)
+        columns = [name for name in schema.names if name not in bbox_columns]
+        for batch in parquet_file.iter_batches(
+            batch_size,
+            columns=columns,
+            use_pandas_metadata=True,
+        ):
+            yield GeoDataFrame.from_arrow(pa.Table.from_batches([batch]))
+
+
 def to_parquet(
     gdf: GeoDataFrame,
     iso3: str,
@@ -45,14 +311,132 @@ def to_parquet(
     """
     file_name = f"{iso3.lower()}_adm{admin_level}.parquet"
     file_path = processing_levels[processing_level] / file_name
+    write_parquet(gdf, file_path)
+
+
+def get_spatial_order(
+    gdf: GeoDataFrame,
+    method: str,
+    group_size: int,
+) -> ndarray:
+    """Gets row positions which sort features spatially.
+
+    Hilbert sorts centres of feature bounds along a Hilbert curve. STR packs
+    them into vertical slices sorted by x, each sorted by y, sized so every row
+    group covers a compact tile. Missing and empty geometries go last.
+
+    Args:
+        gdf: GeoDataFrame to sort.
+        method: hilbert, str or none.
+        group_size: rows per row group.
+
+    Returns:
+        Row positions in sorted order.
+    """
+    valid = ~(gdf.geometry.isna() | gdf.geometry.is_empty).to_numpy()
+    positions = arange(len(gdf.index))
+    if method not in ["hilbert", "str"] or not valid.any():
+        return positions
+    geometry = gdf.geometry[valid]
+    if method == "hilbert":
+        order = argsort(geometry.hilbert_distance().to_numpy(), kind="stable")
+    else:
+        bounds = geometry.bounds.to_numpy()
+        x = (bounds[:, 0] + bounds[:, 2]) / 2
+        y = (bounds[:, 1] + bounds[:, 3]) / 2
+        slices = int(ceil(sqrt(len(x) / group_size)))
+        slice_size = int(ceil(len(x) / slices))
+        slice_ids = argsort(argsort(x, kind="stable"), kind="stable") // slice_size
+        order = lexsort((y, slice_ids))
+    return concatenate([positions[valid][order], positions[~valid]])
+
+
+def write_parquet(
+    gdf: GeoDataFrame,
+    file_path: Path,
+    sort: str = "none",
+    group_size: int = row_group_size,
+    geometry_encoding: Literal["WKB", "geoarrow"] = "geoarrow",
+) -> None:
+    """Writes a GeoParquet file laid out for bbox-filtered partial reads.
+
+    Rows are written in row groups of a fixed size with a bbox covering column.
+    Global files are also sorted spatially, so the statistics of each row group
+    cover a compact area and readers can skip groups outside their bbox. Country
+    files keep their row order, e.g. sorted by pcode.
+
+    Args:
+        gdf: GeoDataFrame to write.
+        file_path: output file.
+        sort: spatial sort, hilbert, str or none.
+        group_size: rows per row group.
+        geometry_encoding: encoding of the geometry column.
+    """
+    default_index = isinstance(gdf.index, RangeIndex)
+    gdf = gdf.iloc[get_spatial_order(gdf, sort, group_size)]
+    if default_index:
+        gdf = gdf.reset_index(drop=True)
     gdf.to_parquet(
         file_path,
         compression="zstd",
-        geometry_encoding="geoarrow",
+        geometry_encoding=geometry_encoding,
         write_covering_bbox=True,
+        row_group_size=group_size,
     )
 
 
+def union_coverage(geometries: ndarray) -> Geometry:
+    """Unions polygons which form a coverage, where shared edges cancel out.
+
+    Coverage union is much faster than a generic union, but is only correct if
+    polygons do not overlap and neighbours share identical vertices. The result is
+    checked against the total area of its parts, falling back to a generic union
+    if the input is not a valid coverage.
+
+    Args:
+        geometries: array of geometries to union.
+
+    Returns:
+        Union of all geometries.
+    """
+    geometries = geometries[~shapely.is_missing(geometries)]
+    geometries = geometries[~shapely.is_empty(geometries)]
+    if len(geometries) == 1:
+        return geometries[0]
+    polygon_types = [shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON]
+    if len(geometries) and isin(shapely.get_type_id(geometries), polygon_types).all():
+        try:
+            result = shapely.coverage_union_all(geometries)
+        except GEOSException:
+            result = None
+        if result is not None and shapely.is_valid(result):
+            area = shapely.area(geometries).sum()
+            if abs(area - result.area) <= area * 1e-9:
+                return result
+    return shapely.union_all(geometries)
+
+
+def dissolve_coverage(gdf: GeoDataFrame, by: str) -> GeoDataFrame:
+    """Dissolves a GeoDataFrame by a column using coverage union.
+
+    Equivalent to GeoDataFrame.dissolve(by, as_index=False), keeping the first
+    value of other columns. Groups with a single row are passed through as-is.
+
+    Args:
+        gdf: GeoDataFrame of admin units forming a coverage.
+        by: column to dissolve by.
+
+    Returns:
+        Dissolved GeoDataFrame.
+    """
+    geometry_name = gdf.active_geometry_name
+    geometries = gdf.geometry.to_numpy()
+    data = gdf.drop(columns=geometry_name).groupby(by, as_index=False).first()
+    indices = gdf.groupby(by).indices
+    data[geometry_name] = [union_coverage(geometries[indices[key]]) for key in data[by]]
+    return GeoDataFrame(data, geometry=geometry_name, crs=gdf.crs)
+
+
 def get_epsg_ease(min_lat: float, max_lat: float) -> Literal[6931, 6932, 6933]:
     """Gets the code for appropriate Equal-Area Scalable Earth grid based on latitude.
 
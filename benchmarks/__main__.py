@@ -0,0 +1,117 @@
+from argparse import ArgumentParser
+from datetime import UTC, datetime
+from json import dumps, loads
+from multiprocessing import get_context
+from pathlib import Path
+from platform import platform, python_version
+from tempfile import TemporaryDirectory
+
+from pycountry import countries
+
+from .runner import run_benchmark
+from .synthetic import write_inputs
+
+names = [
+    "1a.read_and_fix",
+    "1a.name_fixes",
+    "1a.dissolve_and_save",
+    "2b.dissolve_and_save",
+    "2l.clip_dissolve_and_save",
+    "2l.topology",
+    "3.clip_and_save",
+    "3l.clip_lines",
+    "stac.get_collection",
+]
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Prints the change of median times against a baseline.
+
+    Args:
+        results: results of this run.
+        baseline: results of an earlier run with the same parameters.
+    """
+    if baseline["params"] != results["params"]:
+        print("WARNING baseline was run with different parameters")  # noqa: T201
+    for name, result in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:<28} {result['median']:>10.3f}s")  # noqa: T201
+            continue
+        ratio = result["median"] / old["median"]
+        print(  # noqa: T201
+            f"{name:<28} {old['median']:>10.3f}s -> {result['median']:>10.3f}s "
+            f"({ratio:.2f}x)",
+        )
+
+
+def main() -> None:
+    """Generates a synthetic country and benchmarks each stage against it."""
+    parser = ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        type=int,
+        default=[4, 4, 4],
+        help="cells per side each unit is split into, one value per admin level",
+    )
+    parser.add_argument(
+        "--density",
+        type=int,
+        default=16,
+        help="segments per edge of the finest units",
+    )
+    parser.add_argument("--langs", nargs="+", default=["en", "fr"])
+    parser.add_argument("--iso3", type=str.upper, default="BEL")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--benchmarks", nargs="+", choices=names, default=names)
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("--baseline", type=Path, help="earlier output to compare")
+    args = parser.parse_args()
+    params = {
+        "splits": args.splits,
+        "density": args.density,
+        "langs": args.langs,
+        "iso3": args.iso3,
+        "repeat": args.repeat,
+    }
+    results = {
+        "created": datetime.now(tz=UTC).isoformat(),
+        "python": python_version(),
+        "platform": platform(),
+        "params": params,
+        "results": {},
+    }
+    iso2 = countries.get(alpha_3=args.iso3).alpha_2
+    with TemporaryDirectory() as workdir:
+        write_inputs(
+            Path(workdir) / "inputs",
+            args.iso3,
+            iso2,
+            args.splits,
+            args.density,
+            args.langs,
+        )
+        context = get_context("spawn")
+        for name in names:
+            if name not in args.benchmarks:
+                continue
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    run_benchmark,
+                    (name, workdir, args.iso3, args.langs, args.repeat),
+                )
+            results["results"][name] = result
+            print(  # noqa: T201
+                f"{name:<28} {result['median']:>10.3f}s "
+                f"{result['features_per_s']:>12.0f} features/s "
+                f"{result['vertices_per_s']:>14.0f} vertices/s "
+                f"{result['peak_rss_mb']:>8.0f} MB",
+            )
+    args.output.write_text(dumps(results, indent=2))
+    if args.baseline is not None:
+        compare(results, loads(args.baseline.read_text()))
+
+
+if __name__ == "__main__":
+    main()
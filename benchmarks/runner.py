@@ -0,0 +1,62 @@
+from os import environ
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import shapely
+
+
+def run_benchmark(
+    name: str,
+    workdir: str,
+    iso3: str,
+    langs: list[str],
+    repeat: int,
+) -> dict:
+    """Runs one benchmark in a fresh process against synthetic inputs.
+
+    Defined outside of __main__ so that spawned workers can import it.
+
+    Directories are set in the environment before the app is imported, so the
+    pipeline reads and writes only inside the working directory. Peak RSS is
+    measured around the timed calls only, on Linux, and includes setup elsewhere.
+
+    Args:
+        name: benchmark name.
+        workdir: directory with synthetic inputs.
+        iso3: country iso3
+        langs: language codes of name columns.
+        repeat: number of timed runs.
+
+    Returns:
+        Dict of wall times, peak RSS and throughput.
+    """
+    for key in ["INPUTS", "OUTPUTS", "CACHE", "EXTENDED", "STAC"]:
+        environ[key] = str(Path(workdir) / key.lower())
+    environ["FORCE"] = "1"
+    environ["HDX_OFFLINE"] = "1"
+    from app.metrics import get_peak, reset_peak
+
+    from .stages import benchmarks
+
+    func, gdf = benchmarks[name](iso3, langs)
+    features = len(gdf.index)
+    vertices = int(shapely.get_num_coordinates(gdf.geometry.array).sum())
+    seconds = []
+    peaks = []
+    for _ in range(repeat):
+        reset_peak()
+        start = perf_counter()
+        func()
+        seconds.append(perf_counter() - start)
+        peaks.append(get_peak())
+    seconds_median = median(seconds)
+    return {
+        "seconds": seconds,
+        "median": seconds_median,
+        "peak_rss_mb": max(peaks),
+        "features": features,
+        "vertices": vertices,
+        "features_per_s": features / seconds_median,
+        "vertices_per_s": vertices / seconds_median,
+    }
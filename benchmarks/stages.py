@@ -0,0 +1,159 @@
+from collections.abc import Callable
+from pathlib import Path
+
+from geopandas import GeoDataFrame, read_parquet
+
+from app import level_1a, level_2b, level_2l, level_3, level_3l, stac
+from app.config import countries, l2, l2l, l3, l3l
+from app.utils import get_country_files, write_parquet
+
+from .synthetic import to_level_2
+
+type Benchmark = tuple[Callable[[], object], GeoDataFrame]
+
+
+def read_level(directory: Path, iso3: str) -> dict[int, GeoDataFrame]:
+    """Reads all admin levels of a country from a stage output directory.
+
+    Args:
+        directory: stage output directory.
+        iso3: country iso3
+
+    Returns:
+        Mapping of admin level to GeoDataFrame.
+    """
+    return {
+        int(file.stem.split("_adm")[1]): read_parquet(file)
+        for file in get_country_files(directory, iso3)
+    }
+
+
+def get_fixed(iso3: str) -> tuple[GeoDataFrame, int]:
+    """Reads the synthetic source of a country and applies Level-1a fixes.
+
+    Args:
+        iso3: country iso3
+
+    Returns:
+        Tuple of fixed GeoDataFrame and its admin level.
+    """
+    return level_1a.read_and_fix(iso3)
+
+
+def get_level_2(iso3: str, langs: list[str]) -> dict[int, GeoDataFrame]:
+    """Gets Level-2 admin levels of a country, writing them first if missing.
+
+    Args:
+        iso3: country iso3
+        langs: language codes of name columns.
+
+    Returns:
+        Mapping of admin level to GeoDataFrame.
+    """
+    if not get_country_files(l2, iso3):
+        gdf, admin_level = get_fixed(iso3)
+        gdf = to_level_2(gdf, langs, admin_level)
+        level_2b.dissolve_and_save(gdf, iso3, admin_level)
+    return read_level(l2, iso3)
+
+
+def get_lines(iso3: str, langs: list[str]) -> GeoDataFrame:
+    """Gets Level-2 boundary lines of a country, writing them first if missing.
+
+    Args:
+        iso3: country iso3
+        langs: language codes of name columns.
+
+    Returns:
+        GeoDataFrame of boundary lines.
+    """
+    file = l2l / f"{iso3.lower()}.parquet"
+    if not file.exists():
+        gdfs = get_level_2(iso3, langs)
+        lines = level_2l.get_topology_lines(gdfs, iso3)
+        if lines is None:
+            lines = level_2l.get_overlay_lines(gdfs, iso3)
+        write_parquet(lines, file)
+    return read_parquet(file)
+
+
+def bench_read_and_fix(iso3: str, _: list[str]) -> Benchmark:
+    """Reads the synthetic source and applies all Level-1a fixes."""
+    gdf, _ = get_fixed(iso3)
+    return (lambda: level_1a.read_and_fix(iso3)), gdf
+
+
+def bench_name_fixes(iso3: str, _: list[str]) -> Benchmark:
+    """Normalizes names and blanks of Level-1a features before name fixes."""
+    file, admin_level = level_1a.get_source(iso3)
+    gdf = level_1a.config_fixes(read_parquet(file), {})
+    gdf = level_1a.automatic_fixes(gdf)
+    iso2 = countries.get(alpha_3=iso3).alpha_2
+    return (lambda: level_1a.name_fixes(gdf.copy(), iso3, iso2, admin_level)), gdf
+
+
+def bench_dissolve_1a(iso3: str, _: list[str]) -> Benchmark:
+    """Dissolves and writes all Level-1a admin levels."""
+    gdf, admin_level = get_fixed(iso3)
+    return (lambda: level_1a.dissolve_and_save(gdf, iso3, admin_level)), gdf
+
+
+def bench_dissolve_2b(iso3: str, langs: list[str]) -> Benchmark:
+    """Dissolves and writes all Level-2 admin levels."""
+    gdf, admin_level = get_fixed(iso3)
+    gdf = to_level_2(gdf, langs, admin_level)
+    return (lambda: level_2b.dissolve_and_save(gdf, iso3, admin_level)), gdf
+
+
+def bench_overlay_2l(iso3: str, langs: list[str]) -> Benchmark:
+    """Creates Level-2 boundary lines with overlay."""
+    gdfs = get_level_2(iso3, langs)
+    return (lambda: level_2l.get_overlay_lines(gdfs, iso3)), gdfs[max(gdfs)]
+
+
+def bench_topology_2l(iso3: str, langs: list[str]) -> Benchmark:
+    """Creates Level-2 boundary lines from shared arcs."""
+    gdfs = get_level_2(iso3, langs)
+    return (lambda: level_2l.get_topology_lines(gdfs, iso3)), gdfs[max(gdfs)]
+
+
+def bench_clip_3(iso3: str, langs: list[str]) -> Benchmark:
+    """Clips and writes all Level-3 admin levels."""
+    gdfs = get_level_2(iso3, langs)
+
+    def run() -> None:
+        for admin_level, gdf in gdfs.items():
+            level_3.clip_and_save(gdf.copy(), iso3, admin_level)
+
+    return run, gdfs[max(gdfs)]
+
+
+def bench_clip_lines_3l(iso3: str, langs: list[str]) -> Benchmark:
+    """Clips Level-2 boundary lines to the UN boundary."""
+    gdf = get_lines(iso3, langs)
+    return (lambda: level_3l.clip_lines(gdf, iso3)), gdf
+
+
+def bench_collection(iso3: str, langs: list[str]) -> Benchmark:
+    """Builds the Level-3 STAC collection."""
+    gdfs = get_level_2(iso3, langs)
+    if not get_country_files(l3, iso3):
+        for admin_level, gdf in gdfs.items():
+            level_3.clip_and_save(gdf.copy(), iso3, admin_level)
+    lines = l3l / f"{iso3.lower()}.parquet"
+    if not lines.exists():
+        write_parquet(level_3l.clip_lines(get_lines(iso3, langs), iso3), lines)
+    return (lambda: stac.get_collection("3", "Benchmark.", {})), gdfs[max(gdfs)]
+
+
+benchmarks: dict[str, Callable[[str, list[str]], Benchmark]] = {
+    "1a.read_and_fix": bench_read_and_fix,
+    "1a.name_fixes": bench_name_fixes,
+    "1a.dissolve_and_save": bench_dissolve_1a,
+    "2b.dissolve_and_save": bench_dissolve_2b,
+    "2l.clip_dissolve_and_save": bench_overlay_2l,
+    "2l.topology": bench_topology_2l,
+    "3.clip_and_save": bench_clip_3,
+    "3l.clip_lines": bench_clip_lines_3l,
+    "stac.get_collection": bench_collection,
+}
@@ -0,0 +1,200 @@
+from math import prod
+from pathlib import Path
+from shutil import copy
+
+import numpy as np
+import shapely
+from geopandas import GeoDataFrame
+from pandas import NaT, Timestamp
+
+WGS84 = 4326
+ORIGIN = (4.0, 50.0)
+WIDTH = 2.0
+UN_OFFSET = 0.015
+
+
+def get_pcodes(
+    cols: np.ndarray,
+    rows: np.ndarray,
+    splits: list[int],
+    iso2: str,
+) -> list[list[str]]:
+    """Gets pcodes of every admin level for cells of the finest grid.
+
+    Args:
+        cols: column of each finest cell.
+        rows: row of each finest cell.
+        splits: cells per side each unit is split into, for each level.
+        iso2: country iso2, used as the ADM0 pcode.
+
+    Returns:
+        List of pcodes for each level, from ADM0 to the finest level.
+    """
+    size = prod(splits)
+    pcodes = [[iso2] * len(cols)]
+    for level, split in enumerate(splits, start=1):
+        cell = size // prod(splits[:level])
+        local = (cols // cell) % split + (rows // cell) % split * split
+        width = len(str(split * split))
+        pcodes.append(
+            [
+                f"{parent}{index:0{width}d}"
+                for parent, index in zip(pcodes[-1], local, strict=True)
+            ],
+        )
+    return pcodes
+
+
+def get_country(
+    splits: list[int],
+    density: int,
+    langs: list[str],
+    iso2: str,
+) -> GeoDataFrame:
+    """Generates the finest admin level of a synthetic country.
+
+    Units are nested squares of a grid, so every level is a clean coverage.
+    Edges are split into many vertices, taken from one grid of coordinates, so
+    shared edges have exactly the same vertices on both sides. Names include
+    repeated spaces and typographic apostrophes to exercise name fixes.
+
+    Args:
+        splits: cells per side each unit is split into, for each level.
+        density: segments per edge of the finest units.
+        langs: language codes of name columns.
+        iso2: country iso2
+
+    Returns:
+        GeoDataFrame with the columns of a Level-1 source file.
+    """
+    size = prod(splits)
+    rows, cols = np.divmod(np.arange(size * size), size)
+    grid = np.arange(size * density + 1) * WIDTH / (size * density)
+    steps = np.arange(density)
+    ring = np.concatenate(
+        [
+            np.stack([steps, np.zeros(density, int)], axis=1),
+            np.stack([np.full(density, density), steps], axis=1),
+            np.stack([density - steps, np.full(density, density)], axis=1),
+            np.stack([np.zeros(density, int), density - steps], axis=1),
+            [[0, 0]],
+        ],
+    )
+    x = ORIGIN[0] + grid[cols[:, None] * density + ring[:, 0]]
+    y = ORIGIN[1] + grid[rows[:, None] * density + ring[:, 1]]
+    geometry = shapely.polygons(np.stack([x, y], axis=2))
+    pcodes = get_pcodes(cols, rows, splits, iso2)
+    data = {}
+    for level, level_pcodes in enumerate(pcodes):
+        for lang in langs:
+            data[f"ADM{level}_{lang.upper()}"] = [
+                f"  Unit’s  {pcode} "  # noqa: RUF001
+                for pcode in level_pcodes
+            ]
+        data[f"ADM{level}_PCODE"] = level_pcodes
+    gdf = GeoDataFrame(data, geometry=geometry, crs=WGS84)
+    gdf["date"] = Timestamp("2020-01-01").date()
+    gdf["validOn"] = Timestamp("2024-01-01").date()
+    gdf["validTo"] = NaT
+    gdf["validTo"] = gdf["validTo"].astype("date32[pyarrow]")
+    return gdf
+
+
+def to_level_2(gdf: GeoDataFrame, langs: list[str], admin_level: int) -> GeoDataFrame:
+    """Converts a synthetic country to the schema of Level-2 inputs.
+
+    Args:
+        gdf: GeoDataFrame from get_country.
+        langs: language codes of name columns.
+        admin_level: finest admin level.
+
+    Returns:
+        GeoDataFrame with lowercase columns as written by Level-1b.
+    """
+    data = {}
+    for level in range(admin_level, -1, -1):
+        for index, lang in enumerate(langs):
+            data[f"adm{level}_name{index or ''}"] = gdf[f"ADM{level}_{lang.upper()}"]
+        data[f"adm{level}_pcode"] = gdf[f"ADM{level}_PCODE"]
+    for index, lang in enumerate(langs):
+        data[f"lang{index or ''}"] = lang
+    data["date"] = gdf["date"]
+    data["validon"] = gdf["validOn"]
+    data["validto"] = gdf["validTo"]
+    return GeoDataFrame(data, geometry=gdf.geometry, crs=gdf.crs)
+
+
+def get_un(iso3: str, density: int) -> tuple[GeoDataFrame, GeoDataFrame]:
+    """Generates stand-ins for UN country boundaries and boundary lines.
+
+    The boundary is offset from the synthetic country so that units along one
+    side and one end are clipped, while the rest lie inside it.
+
+    Args:
+        iso3: country iso3
+        density: segments per side of the boundary.
+
+    Returns:
+        Tuple of bnda_cty polygons and bndl lines.
+    """
+    min_x, min_y = ORIGIN[0] + WIDTH * UN_OFFSET, ORIGIN[1] + WIDTH * UN_OFFSET
+    polygon = shapely.segmentize(
+        shapely.box(min_x, min_y, min_x + WIDTH, min_y + WIDTH),
+        WIDTH / density,
+    )
+    bnda = GeoDataFrame({"iso3cd": [iso3]}, geometry=[polygon], crs=WGS84)
+    coords = shapely.get_coordinates(polygon.exterior)
+    sides = np.array_split(np.arange(len(coords)), 4)
+    lines = [
+        shapely.linestrings(coords[[*side, min(side[-1] + 1, len(coords) - 1)]])
+        for side in sides
+    ]
+    bndl = GeoDataFrame(
+        {
+            "bdytyp": [1, 1, 1, 6],
+            "iso3cd": [iso3, f"{iso3};ZZZ", iso3, iso3],
+        },
+        geometry=lines,
+        crs=WGS84,
+    )
+    return bnda, bndl
+
+
+def write_inputs(  # noqa: PLR0913
+    inputs: Path,
+    iso3: str,
+    iso2: str,
+    splits: list[int],
+    density: int,
+    langs: list[str],
+) -> GeoDataFrame:
+    """Writes a synthetic country and UN boundaries as pipeline inputs.
+
+    Config files are copied from the repository inputs so no download is needed.
+
+    Args:
+        inputs: inputs directory to create.
+        iso3: country iso3
+        iso2: country iso2
+        splits: cells per side each unit is split into, for each level.
+        density: segments per edge of the finest units.
+        langs: language codes of name columns.
+
+    Returns:
+        GeoDataFrame of the finest admin level.
+    """
+    source = Path(__file__).parent / "../inputs"
+    for name in ["level_1a.json", "level_2.json", "m49.csv"]:
+        inputs.mkdir(parents=True, exist_ok=True)
+        copy(source / name, inputs / name)
+    gdf = get_country(splits, density, langs, iso2)
+    hdx = inputs / "hdx"
+    hdx.mkdir(exist_ok=True)
+    gdf.to_parquet(hdx / f"{iso3.lower()}_adm{len(splits)}.parquet")
+    bnda, bndl = get_un(iso3, density * prod(splits))
+    un = inputs / "un"
+    un.mkdir(exist_ok=True)
+    bnda.to_parquet(un / "bnda_cty.parquet")
+    bnda.iloc[:0].to_parquet(un / "bnda_dsp.parquet")
+    bndl.to_parquet(un / "bndl.parquet")
+    return gdf
@@ -1,30 +1,211 @@
 from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import sha256
+from json import dumps, loads
+from os import process_cpu_count
 from pathlib import Path
-from subprocess import run
+from subprocess import CalledProcessError, run
+from tempfile import TemporaryDirectory
+
+import shapely
+from geopandas import GeoDataFrame
+from pyogrio import read_dataframe
+from tqdm import tqdm
 
 cwd = Path(__file__).parent
 
-parser = ArgumentParser()
-parser.add_argument("--format", required=True, help="input format")
-parser.add_argument("--input", required=True, help="input directory")
-parser.add_argument("--output", required=True, help="output directory")
-args = parser.parse_args()
+multi_types = {
+    shapely.GeometryType.POINT: shapely.multipoints,
+    shapely.GeometryType.LINESTRING: shapely.multilinestrings,
+    shapely.GeometryType.POLYGON: shapely.multipolygons,
+}
+
+
+def get_source_files(input_file: Path) -> list[Path]:
+    """Get all files which make up a source, e.g. sidecars of a shapefile.
+
+    Sidecars are matched on the name before the first dot, so multi-part
+    extensions such as x.shp.xml belong to x.shp.
+    """
+    if input_file.is_dir():
+        return sorted(x for x in input_file.rglob("*") if x.is_file())
+    name = input_file.name.split(".")[0]
+    return sorted(
+        x
+        for x in input_file.parent.iterdir()
+        if x.is_file() and x.name.split(".")[0] == name
+    )
+
+
+def get_duplicates(input_files: list[Path], input_dir: Path) -> dict[str, str]:
+    """Get errors for sources sharing a stem, which would share an output file."""
+    stems = Counter(x.stem for x in input_files)
+    return {
+        str(x.relative_to(input_dir)): f"duplicate stem {x.stem}, output skipped"
+        for x in input_files
+        if stems[x.stem] > 1
+    }
+
+
+def get_sidecar(output_file: Path) -> Path:
+    """Get the manifest file stored next to an output."""
+    return output_file.with_suffix(".source.json")
+
+
+def describe(input_file: Path, engine: str, previous: dict) -> dict:
+    """Describe a source by size, mtime and hash, reusing an unchanged hash."""
+    files = get_source_files(input_file)
+    stats = [x.stat() for x in files]
+    size = sum(x.st_size for x in stats)
+    mtime = max((x.st_mtime_ns for x in stats), default=0)
+    if previous.get("size") == size and previous.get("mtime") == mtime:
+        source_hash = previous["hash"]
+    else:
+        digest = sha256()
+        for file in files:
+            digest.update(file.name.encode())
+            with file.open("rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        source_hash = digest.hexdigest()
+    return {"size": size, "mtime": mtime, "hash": source_hash, "engine": engine}
+
+
+def promote_to_multi(gdf: GeoDataFrame) -> GeoDataFrame:
+    """Promote single part geometries to multi part, like PROMOTE_TO_MULTI."""
+    geometry = gdf.geometry.array.copy()
+    type_ids = shapely.get_type_id(geometry)
+    for type_id, func in multi_types.items():
+        mask = type_ids == type_id
+        if mask.any():
+            geometry[mask] = func(geometry[mask], indices=range(mask.sum()))
+    return gdf.set_geometry(geometry, crs=gdf.crs)
+
+
+def to_parquet_pyogrio(input_file: Path, output_file: Path) -> None:
+    """Convert a file to GeoParquet in-process through pyogrio's Arrow reader."""
+    gdf = read_dataframe(input_file, use_arrow=True)
+    gdf = promote_to_multi(gdf)
+    if gdf.geometry.name != "geometry":
+        gdf = gdf.rename_geometry("geometry")
+    for column in gdf.columns:
+        if gdf[column].dtype.kind == "M":
+            gdf[column] = gdf[column].dt.date
+    gdf.to_parquet(output_file, compression="zstd", geometry_encoding="geoarrow")
+
+
+def to_parquet_ogr2ogr(input_file: Path, output_file: Path) -> None:
+    """Convert a file to GeoParquet with ogr2ogr."""
+    run(
+        [
+            "ogr2ogr",
+            *["-nlt", "PROMOTE_TO_MULTI"],
+            *["-lco", "COMPRESSION=ZSTD"],
+            *["-lco", "GEOMETRY_ENCODING=GEOARROW"],
+            *["-lco", "GEOMETRY_NAME=geometry"],
+            *["-mapFieldType", "DateTime=Date"],
+            *[output_file, input_file],
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+
+def convert(
+    input_file: Path,
+    output_file: Path,
+    engine: str,
+    *,
+    force: bool,
+) -> bool:
+    """Convert a file unless its source is unchanged since the last conversion.
+
+    The file is written to a hidden temporary directory next to the output and
+    moved into place once complete. Stages only list files directly in the
+    output directory, so they never read a partial file. The temporary
+    directory is removed even if the conversion fails.
+
+    Returns:
+        True if the file was converted, False if it was skipped.
+    """
+    sidecar = get_sidecar(output_file)
+    previous = loads(sidecar.read_text()) if sidecar.exists() else {}
+    source = describe(input_file, engine, previous)
+    if not force and output_file.exists() and previous == source:
+        return False
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory(dir=output_file.parent, prefix=".") as tmp_dir:
+        tmp_file = Path(tmp_dir) / output_file.name
+        if engine == "pyogrio":
+            to_parquet_pyogrio(input_file, tmp_file)
+        else:
+            to_parquet_ogr2ogr(input_file, tmp_file)
+        tmp_file.replace(output_file)
+    sidecar.write_text(dumps(source, indent=2))
+    return True
+
+
+def get_error(error: Exception) -> str:
+    """Get a readable message for a failed conversion."""
+    if isinstance(error, CalledProcessError):
+        return (error.stderr or str(error)).strip()
+    return f"{type(error).__name__}: {error}"
+
+
+def main() -> None:
+    """Convert all files of a format in a directory to GeoParquet."""
+    parser = ArgumentParser()
+    parser.add_argument("--format", required=True, help="input format")
+    parser.add_argument("--input", required=True, help="input directory")
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=process_cpu_count() or 1,
+        help="number of conversions to run at once",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["ogr2ogr", "pyogrio"],
+        default="ogr2ogr",
+        help="convert with ogr2ogr subprocesses or in-process with pyogrio",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="convert files even if their source is unchanged",
+    )
+    args = parser.parse_args()
+    input_dir = cwd / args.input
+    input_files = sorted(input_dir.rglob(f"*.{args.format}"))
+    errors = get_duplicates(input_files, input_dir)
+    skipped = 0
+    with ProcessPoolExecutor(max(args.workers, 1)) as executor:
+        futures = {
+            executor.submit(
+                convert,
+                input_file,
+                cwd / args.output / f"{input_file.stem}.parquet",
+                args.engine,
+                force=args.force,
+            ): input_file
+            for input_file in input_files
+            if str(input_file.relative_to(input_dir)) not in errors
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                skipped += not future.result()
+            except Exception as error:  # noqa: BLE001
+                errors[str(futures[future].relative_to(input_dir))] = get_error(error)
+    print(f"{len(input_files) - skipped - len(errors)} converted, {skipped} skipped.")  # noqa: T201
+    for name, error in sorted(errors.items()):
+        print(f"ERROR {name}\n{error}")  # noqa: T201
+    if len(errors):
+        print(f"{len(errors)} failed: {', '.join(sorted(errors))}")  # noqa: T201
+        raise SystemExit(1)
+
 
 if __name__ == "__main__":
-    input_files = (cwd / args.input).rglob(f"*.{args.format}")
-    for input_file in input_files:
-        output_file = cwd / args.output / f"{input_file.stem}.parquet"
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        output_file.unlink(missing_ok=True)
-        run(
-            [
-                "ogr2ogr",
-                *["-nlt", "PROMOTE_TO_MULTI"],
-                *["-lco", "COMPRESSION=ZSTD"],
-                *["-lco", "GEOMETRY_ENCODING=GEOARROW"],
-                *["-lco", "GEOMETRY_NAME=geometry"],
-                *["-mapFieldType", "DateTime=Date"],
-                *[output_file, input_file],
-            ],
-            check=False,
-        )
+    main()
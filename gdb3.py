@@ -3,10 +3,13 @@ from shutil import rmtree
 from subprocess import run
 
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyogrio import set_gdal_config_options, write_arrow
+from tqdm import tqdm
 
 cwd = Path(__file__).parent
 
-output_dir_tmp = cwd / "gdb/level-3-tmp.gdb"
 output_dir = cwd / "gdb/level-3.gdb"
 output_file = cwd / "gdb/level-3.gdb.zip"
 
@@ -30,87 +33,140 @@ def get_fields(adm_lvl: int) -> str:
     return ",".join(result)
 
 
-def run_lines() -> None:
-    """Merge all lines into a single GDB."""
-    input_dir = cwd / "outputs/level-3-lines"
-    run(
-        [
-            "ogrmerge",
-            "-progress",
-            "-single",
-            *["--config", "OGR_ORGANIZE_POLYGONS", "ONLY_CCW"],
-            *["-of", "OpenFileGDB"],
-            *["-nln", "lines"],
-            *["-lco", "TARGET_ARCGIS_VERSION=ARCGIS_PRO_3_2_OR_LATER"],
-            *["-o", output_dir_tmp],
-            *sorted(input_dir.glob("*.parquet")),
-        ],
-        check=False,
+def get_types(files: list[Path], columns: list[str]) -> dict[str, pa.DataType]:
+    """Gets a shared type for each column from the schemas of all files.
+
+    Only file footers are read. Columns with conflicting types across files are
+    stored as strings, and columns missing from every file as null strings.
+
+    Args:
+        files: parquet files to merge.
+        columns: columns of the merged layer.
+
+    Returns:
+        Mapping of column name to type.
+    """
+    types = {}
+    for file in files:
+        schema = pq.read_schema(file)
+        for column in columns:
+            if column not in schema.names:
+                continue
+            column_type = schema.field(column).type
+            if pa.types.is_null(column_type):
+                continue
+            if types.setdefault(column, column_type) != column_type:
+                types[column] = pa.string()
+    return {column: types.get(column, pa.string()) for column in columns}
+
+
+def read_table(file: Path, types: dict[str, pa.DataType]) -> tuple[pa.Table, str]:
+    """Reads a file as an Arrow table with WKB geometry and the merged schema.
+
+    Args:
+        file: parquet file.
+        types: mapping of column name to type from get_types.
+
+    Returns:
+        Tuple of table and CRS as WKT.
+    """
+    gdf = gpd.read_parquet(file)
+    table = pa.table(gdf.to_arrow(index=False, geometry_encoding="WKB"))
+    arrays = []
+    for column, column_type in types.items():
+        if column == "layer":
+            arrays.append(pa.array([file.stem] * table.num_rows, column_type))
+        elif column in table.column_names:
+            arrays.append(table[column].cast(column_type))
+        else:
+            arrays.append(pa.nulls(table.num_rows, column_type))
+    geometry = table.schema.field(gdf.geometry.name)
+    table = pa.Table.from_arrays(
+        [*arrays, table[gdf.geometry.name]],
+        schema=pa.schema(
+            [*[pa.field(k, v) for k, v in types.items()], geometry],
+        ),
     )
+    return table, gdf.crs.to_wkt()
 
 
-def run_polygons() -> None:
-    """Merge all polygons into a single GDB."""
-    input_dir = cwd / "outputs/level-3"
-    for adm_lvl in range(5):
-        run(
-            [
-                "ogrmerge",
-                "-progress",
-                "-single",
-                "-update",
-                *["--config", "OGR_ORGANIZE_POLYGONS", "ONLY_CCW"],
-                *["-nln", f"adm{adm_lvl}"],
-                *["-src_layer_field_name", "layer"],
-                *["-lco", "TARGET_ARCGIS_VERSION=ARCGIS_PRO_3_2_OR_LATER"],
-                *["-o", output_dir_tmp],
-                *sorted(input_dir.glob(f"*_adm{adm_lvl}.parquet")),
-            ],
-            check=False,
+def write_layer(
+    files: list[Path],
+    layer: str,
+    columns: list[str],
+    geometry_type: str,
+    dedupe: list[str] | None = None,
+) -> None:
+    """Merges files into a single GDB layer, written once.
+
+    Files are read one at a time and appended to the layer as Arrow tables.
+
+    Args:
+        files: parquet files to merge.
+        layer: name of the layer.
+        columns: columns of the layer, in order.
+        geometry_type: geometry type of the layer.
+        dedupe: columns identifying duplicates, of which only the first is kept.
+    """
+    types = get_types(files, columns)
+    seen = set()
+    append = False
+    for file in tqdm(files, desc=layer):
+        table, crs = read_table(file, types)
+        if dedupe is not None:
+            keys = zip(*[table[column].to_pylist() for column in dedupe], strict=True)
+            mask = []
+            for key in keys:
+                mask.append(key not in seen)
+                seen.add(key)
+            table = table.filter(pa.array(mask, pa.bool_()))
+        if table.num_rows == 0:
+            continue
+        write_arrow(
+            table,
+            output_dir,
+            layer=layer,
+            driver="OpenFileGDB",
+            geometry_name=table.schema.names[-1],
+            geometry_type=geometry_type,
+            crs=crs,
+            append=append,
+            layer_options={"TARGET_ARCGIS_VERSION": "ARCGIS_PRO_3_2_OR_LATER"},
         )
+        append = True
 
 
-def deduplicate_lines() -> None:
-    """Deduplicate lines."""
-    gdf = gpd.read_file(output_dir_tmp, layer="lines", use_arrow=True)
-    gdf = gdf.drop_duplicates(subset=["bdytyp", "iso3cd"])
-    gdf.to_file(
-        output_dir,
-        layer="lines",
-        driver="OpenFileGDB",
-        layer_options={"TARGET_ARCGIS_VERSION": "ARCGIS_PRO_3_2_OR_LATER"},
-        use_arrow=True,
+def write_lines() -> None:
+    """Merges all lines into the GDB, dropping duplicate international lines."""
+    files = sorted((cwd / "outputs/level-3-lines").glob("*.parquet"))
+    write_layer(
+        files,
+        "lines",
+        ["bdytyp", "iso3cd"],
+        "MultiLineString",
+        dedupe=["bdytyp", "iso3cd"],
     )
 
 
-def transfer_polygons() -> None:
-    """Transfer polygons to the final GDB."""
+def write_polygons() -> None:
+    """Merges all polygons into the GDB, one layer per admin level."""
+    input_dir = cwd / "outputs/level-3"
     for adm_lvl in range(5):
-        run(
-            [
-                "ogr2ogr",
-                "-update",
-                *["--config", "OGR_ORGANIZE_POLYGONS", "ONLY_CCW"],
-                *["-select", get_fields(adm_lvl)],
-                *["-nln", f"adm{adm_lvl}"],
-                *["-lco", "TARGET_ARCGIS_VERSION=ARCGIS_PRO_3_2_OR_LATER"],
-                output_dir,
-                *[output_dir_tmp, f"adm{adm_lvl}"],
-            ],
-            check=False,
+        write_layer(
+            sorted(input_dir.glob(f"*_adm{adm_lvl}.parquet")),
+            f"adm{adm_lvl}",
+            get_fields(adm_lvl).split(","),
+            "MultiPolygon",
         )
 
 
 if __name__ == "__main__":
     """Merge all outputs into a single GDB and upload it to S3."""
-    rmtree(output_dir_tmp, ignore_errors=True)
     rmtree(output_dir, ignore_errors=True)
     output_file.unlink(missing_ok=True)
-    run_lines()
-    run_polygons()
-    deduplicate_lines()
-    transfer_polygons()
-    rmtree(output_dir_tmp, ignore_errors=True)
+    set_gdal_config_options({"OGR_ORGANIZE_POLYGONS": "ONLY_CCW"})
+    write_lines()
+    write_polygons()
     run(
         ["sozip", "--recurse-paths", "--junk-paths", output_file, output_dir],
         check=False,
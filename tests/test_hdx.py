@@ -0,0 +1,95 @@
+from asyncio import Semaphore, run
+from pathlib import Path
+from time import time
+
+import httpx
+import pytest
+
+from app import hdx
+
+RESULT = {"name": "cod-ab-aaa", "metadata_modified": "2024-01-01T00:00:00"}
+
+
+@pytest.fixture(autouse=True)
+def hdx_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Points the HDX cache at a temporary directory and disables offline mode."""
+    monkeypatch.setattr(hdx, "hdx_cache", tmp_path)
+    monkeypatch.setattr(hdx, "HDX_OFFLINE", False)
+    return tmp_path
+
+
+def fetch(transport: httpx.MockTransport) -> dict:
+    """Fetches a country from a stand-in HDX server."""
+
+    async def main() -> dict:
+        async with httpx.AsyncClient(
+            base_url="https://hdx.test",
+            transport=transport,
+        ) as client:
+            return await hdx.fetch(client, Semaphore(1), "AAA")
+
+    return run(main())
+
+
+def test_fresh_entry_is_served_from_cache() -> None:
+    """A fresh cache entry is returned without a request."""
+    hdx.save_cached("AAA", {"fetched": time(), "result": RESULT})
+
+    def handler(_: httpx.Request) -> httpx.Response:
+        pytest.fail("fresh entries should not be requested")
+
+    assert fetch(httpx.MockTransport(handler)) == RESULT
+
+
+def test_stale_entry_is_revalidated() -> None:
+    """A 304 keeps the cached result and renews its fetch time."""
+    hdx.save_cached("AAA", {"fetched": 0, "etag": '"abc"', "result": RESULT})
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["If-None-Match"] == '"abc"'
+        return httpx.Response(httpx.codes.NOT_MODIFIED)
+
+    assert fetch(httpx.MockTransport(handler)) == RESULT
+    entry = hdx.load_cached("AAA")
+    assert entry["result"] == RESULT
+    assert time() - entry["fetched"] < hdx.HDX_TTL
+
+
+@pytest.mark.parametrize("status_code", [401, 403, 429, 503])
+def test_error_keeps_stale_entry(status_code: int) -> None:
+    """Non-2xx responses return the stale result and leave the cache as-is."""
+    entry = {"fetched": 0, "etag": '"abc"', "result": RESULT}
+    hdx.save_cached("AAA", entry)
+
+    def handler(_: httpx.Request) -> httpx.Response:
+        return httpx.Response(status_code, json={"success": False, "error": {}})
+
+    assert fetch(httpx.MockTransport(handler)) == RESULT
+    assert hdx.load_cached("AAA") == entry
+
+
+def test_missing_package_is_cached() -> None:
+    """A 404 is cached as an empty result."""
+    hdx.save_cached("AAA", {"fetched": 0, "result": RESULT})
+
+    def handler(_: httpx.Request) -> httpx.Response:
+        return httpx.Response(httpx.codes.NOT_FOUND, json={"success": False})
+
+    assert fetch(httpx.MockTransport(handler)) == {}
+    assert hdx.load_cached("AAA")["result"] == {}
+
+
+def test_success_is_cached() -> None:
+    """A 200 is cached with its validators."""
+
+    def handler(_: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            httpx.codes.OK,
+            json={"success": True, "result": RESULT},
+            headers={"ETag": '"def"'},
+        )
+
+    assert fetch(httpx.MockTransport(handler)) == RESULT
+    entry = hdx.load_cached("AAA")
+    assert entry["result"] == RESULT
+    assert entry["etag"] == '"def"'
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+import pytest
+
+from app import level_1a, utils
+from benchmarks.synthetic import get_country
+
+
+def test_partitioned_matches_in_memory(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Dissolving by ADM1 partition writes the same files as the in-memory path."""
+    source = tmp_path / "bel_adm3.parquet"
+    utils.write_parquet(get_country([4, 4, 4], 4, ["en"], "BE"), source)
+    monkeypatch.setattr(level_1a, "cache", tmp_path / "cache")
+    monkeypatch.setattr(level_1a, "memory_budget_mb", 1)
+    batch_size = level_1a.get_batch_size(source)
+    assert batch_size is not None
+    assert batch_size < pq.read_metadata(source).num_rows
+    outputs = {}
+    for name in ["memory", "partitioned"]:
+        outputs[name] = tmp_path / name
+        outputs[name].mkdir()
+        monkeypatch.setitem(utils.processing_levels, "1a", outputs[name])
+        if name == "memory":
+            gdf = level_1a.apply_fixes(gpd.read_parquet(source), "BEL", 3)
+            level_1a.dissolve_and_save(gdf, "BEL", 3)
+        else:
+            level_1a.dissolve_partitioned(source, "BEL", 3, batch_size)
+    for admin_level in range(4):
+        name = f"bel_adm{admin_level}.parquet"
+        memory = outputs["memory"] / name
+        partitioned = outputs["partitioned"] / name
+        assert pq.read_schema(partitioned).equals(pq.read_schema(memory))
+        assert (
+            pq.read_metadata(partitioned).num_row_groups
+            == pq.read_metadata(memory).num_row_groups
+        )
+        expected = gpd.read_parquet(memory)
+        result = gpd.read_parquet(partitioned)
+        assert result.drop(columns="geometry").equals(expected.drop(columns="geometry"))
+        assert result.geometry.geom_equals(expected.geometry).all()
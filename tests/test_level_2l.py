@@ -0,0 +1,46 @@
+import pytest
+import shapely
+from geopandas import GeoDataFrame
+
+from app import level_2l
+from app.utils import dissolve_coverage
+from benchmarks.synthetic import get_country, to_level_2
+
+
+def get_levels(gdf: GeoDataFrame) -> dict[int, GeoDataFrame]:
+    """Dissolves a Level-2 country into polygons of each admin level."""
+    return {
+        0: dissolve_coverage(gdf, "adm0_pcode"),
+        1: dissolve_coverage(gdf, "adm1_pcode"),
+        2: gdf,
+    }
+
+
+@pytest.fixture
+def country() -> GeoDataFrame:
+    """Synthetic country whose units share vertices along every edge."""
+    return to_level_2(get_country([2, 3], 3, ["en"], "BE"), ["en"], 2)
+
+
+@pytest.mark.filterwarnings("error::UserWarning")
+def test_topology_lines_match_overlay(country: GeoDataFrame) -> None:
+    """Shared arcs give the same lines as overlay on a clean coverage."""
+    gdfs = get_levels(country)
+    topology = level_2l.get_topology_lines(gdfs, "BEL")
+    overlay = level_2l.get_overlay_lines(gdfs, "BEL")
+    assert topology is not None
+    assert sorted(topology["bdytyp"]) == sorted(overlay["bdytyp"])
+    for bdytyp in overlay["bdytyp"]:
+        expected = overlay.geometry[overlay["bdytyp"] == bdytyp].union_all()
+        result = topology.geometry[topology["bdytyp"] == bdytyp].union_all()
+        assert shapely.length(shapely.symmetric_difference(result, expected)) == 0
+
+
+def test_topology_lines_fall_back_without_shared_vertices(
+    country: GeoDataFrame,
+) -> None:
+    """Edges whose vertices do not match on both sides fall back to overlay."""
+    geometry = country.geometry.array.copy()
+    geometry[0] = shapely.segmentize(geometry[0], 0.01)
+    gdfs = get_levels(country.set_geometry(geometry))
+    assert level_2l.get_topology_lines(gdfs, "BEL") is None
@@ -0,0 +1,73 @@
+from collections.abc import Iterator
+from os import utime
+from pathlib import Path
+
+import pytest
+
+from app import manifest
+
+
+@pytest.fixture(autouse=True)
+def project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    """Points the manifest, project root and code at a temporary directory."""
+    code = tmp_path / "code.py"
+    code.write_text("x = 1\n")
+    (tmp_path / "input.txt").write_text("input")
+    (tmp_path / "output.txt").write_text("output")
+    monkeypatch.setattr(manifest, "root", tmp_path)
+    monkeypatch.setattr(manifest, "manifest", tmp_path / "manifest")
+    monkeypatch.setattr(manifest, "force_rebuild", False)
+    monkeypatch.setattr(manifest, "code_files", [code])
+    manifest.get_code_version.cache_clear()
+    yield tmp_path
+    manifest.get_code_version.cache_clear()
+
+
+def build(project: Path, config: object = None) -> None:
+    """Runs a stand-in task which copies its input to its output."""
+    record = manifest.get_record("app.stage", "aaa", [project / "input.txt"], config)
+    manifest.save(record, [project / "output.txt"])
+
+
+def is_fresh(project: Path, config: object = None) -> bool:
+    """Checks the stand-in task against its stored record."""
+    manifest.get_code_version.cache_clear()
+    record = manifest.get_record("app.stage", "aaa", [project / "input.txt"], config)
+    return manifest.is_fresh(record)
+
+
+def test_unchanged_task_is_fresh(project: Path) -> None:
+    """A task is fresh when its inputs, config, code and outputs are unchanged."""
+    assert not is_fresh(project)
+    build(project)
+    assert is_fresh(project)
+
+
+def test_changed_input_is_stale(project: Path) -> None:
+    """A task is stale when an input changes."""
+    build(project)
+    (project / "input.txt").write_text("changed")
+    assert not is_fresh(project)
+
+
+def test_changed_config_is_stale(project: Path) -> None:
+    """A task is stale when its slice of config changes."""
+    build(project, {"adm": 1})
+    assert is_fresh(project, {"adm": 1})
+    assert not is_fresh(project, {"adm": 2})
+
+
+def test_changed_code_is_stale(project: Path) -> None:
+    """A task is stale when any app module changes, not only its own."""
+    build(project)
+    (project / "code.py").write_text("x = 2\n")
+    assert not is_fresh(project)
+
+
+def test_touched_output_is_stale(project: Path) -> None:
+    """A task is stale when an output was modified after it was written."""
+    build(project)
+    output = project / "output.txt"
+    stat = output.stat()
+    utime(output, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert not is_fresh(project)
@@ -0,0 +1,18 @@
+from os import getpid, kill
+from signal import SIGKILL
+
+from app import parallel
+
+
+def crash(item: int) -> None:
+    """Stand-in task whose worker is killed, like by the OOM killer, on item 3."""
+    if item == 3:  # noqa: PLR2004
+        kill(getpid(), SIGKILL)
+
+
+def test_killed_worker_fails_its_task() -> None:
+    """A killed worker is recorded as a failure and later items still run."""
+    errors = parallel.run_parallel(crash, range(20), workers=2)
+    assert "3" in errors
+    assert "BrokenProcessPool" in errors["3"]
+    assert "19" not in errors
@@ -0,0 +1,69 @@
+from app import scheduler
+
+
+def test_country_waits_for_its_upstream_stages() -> None:
+    """Each country task depends on the selected stages before it."""
+    graph = scheduler.get_graph(["1", "1a", "1b"], ["BEL", "NLD"])
+    assert graph[("1", "BEL")] == set()
+    assert graph[("1a", "BEL")] == {("1", "BEL")}
+    assert graph[("1b", "NLD")] == {("1a", "NLD")}
+
+
+def test_unselected_stages_are_assumed_complete() -> None:
+    """Dependencies skip over stages which are not selected."""
+    graph = scheduler.get_graph(["1", "1b"], ["BEL"])
+    assert graph[("1b", "BEL")] == {("1", "BEL")}
+    graph = scheduler.get_graph(["1b"], ["BEL"])
+    assert graph == {("1b", "BEL"): set()}
+
+
+def test_split_country_waits_for_its_source() -> None:
+    """A country split at Level-2a waits for the source which writes its files."""
+    graph = scheduler.get_graph(["1b", "2a", "extend"], ["CHN", "HKG"])
+    assert scheduler.get_upstream_tasks(("extend", "HKG"), ["CHN", "HKG"]) == [
+        ("2a", "HKG"),
+        ("2a", "CHN"),
+        ("fused", "HKG"),
+        ("fused", "CHN"),
+    ]
+    assert graph[("extend", "HKG")] == {("2a", "HKG"), ("2a", "CHN")}
+    assert graph[("2a", "HKG")] == {("1b", "HKG")}
+
+
+def test_global_stage_waits_for_all_countries() -> None:
+    """Global stages have one task per file, each waiting for every country."""
+    graph = scheduler.get_graph(["3", "merge"], ["BEL", "NLD"])
+    merges = [task for task in graph if task[0] == "merge"]
+    assert len(merges) == len(scheduler.merge.get_outputs())
+    for task in merges:
+        assert graph[task] == {("3", "BEL"), ("3", "NLD")}
+        assert scheduler.get_pool(task) == "global"
+    graph = scheduler.get_graph(["pmtiles", "stac"], ["BEL"])
+    assert graph[("stac", None)] == {("pmtiles", "BEL")}
+
+
+def test_select_stages() -> None:
+    """Stages are selected between --from and --until, filtered by --stages."""
+    names = [stage for stage in scheduler.stages if stage != "fused"]
+    assert scheduler.select_stages(names, "2b", "3") == ["2b", "2l", "3"]
+    assert scheduler.select_stages(["1", "3"], "1", "stac") == ["1", "3"]
+    assert scheduler.select_stages(names, "1a", "extend", fused=True) == [
+        "extend",
+        "fused",
+    ]
+    assert scheduler.select_stages(names, "2b", "3", fused=True) == [
+        "2b",
+        "2l",
+        "3",
+    ]
+
+
+def test_failure_skips_only_downstream_tasks() -> None:
+    """Tasks downstream of a failure are skipped, other countries are not."""
+    graph = scheduler.get_graph(["1", "1a", "1b", "merge"], ["BEL", "NLD"])
+    dependents = scheduler.get_dependents(graph)
+    skipped = scheduler.get_downstream(("1", "BEL"), dependents)
+    assert ("1a", "BEL") in skipped
+    assert ("1b", "BEL") in skipped
+    assert all(task in skipped for task in graph if task[0] == "merge")
+    assert not any(task[1] == "NLD" for task in skipped)